@@ -165,8 +165,29 @@ class BackendLogic:
         })
 
     def get_transaction_history(self) -> Optional[List[Dict]]:
+        """
+        Đọc lịch sử trực tiếp từ node qua `/address/<addr>/transactions`, lần theo `next_cursor`
+        tới hết, rồi đổi mỗi mục sang dạng {from, to, amount, timestamp, type} mà màn hình lịch sử dùng.
+        """
         if not self.wallet: return None
-        return self._make_api_request('GET', f"/api/v1/transaction_history/{self.wallet.get_address()}")
+        node_url = self.miner_status.get('current_node')
+        if not node_url or node_url == "None":
+            node_info = self._miner_find_best_node()
+            if not node_info: return {"error": "Không tìm thấy node nào hoạt động."}
+            node_url = node_info['url']
+        address, history, cursor = self.wallet.get_address(), [], None
+        try:
+            while True:
+                response = requests.get(f"{node_url}/address/{address}/transactions", params={'cursor': cursor} if cursor else None, timeout=15)
+                response.raise_for_status(); page = response.json()
+                for entry in page.get('transactions', []):
+                    tx = entry.get('transaction', {})
+                    history.append({"tx_id": entry.get('tx_id'), "from": tx.get('sender_address'), "to": tx.get('recipient_address'), "amount": tx.get('amount'), "timestamp": tx.get('timestamp'), "type": 'reward' if tx.get('sender_address') == "0" else 'transfer'})
+                cursor = page.get('next_cursor')
+                if not cursor: return history
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logging.error(f"Lỗi tải lịch sử từ {node_url}: {e}")
+            return {"error": f"Không thể tải lịch sử giao dịch: {e}"}
 
     def add_website(self, url: str) -> Optional[Dict]:
         if not self.wallet: return {"error": "Ví chưa được mở khóa."}
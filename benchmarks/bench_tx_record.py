@@ -0,0 +1,57 @@
+# benchmarks/bench_tx_record.py
+# -*- coding: utf-8 -*-
+"""
+So sánh chi phí trên mỗi giao dịch giữa cách cũ (dict + transaction_id tính lại ở
+từng bước) và TxRecord (byte chuẩn hóa + mã giao dịch tính một lần).
+
+Đường đi của một giao dịch qua node trước khi có TxRecord:
+  add_transaction (id + json.dumps đo kích thước) -> mine_pending_transactions (id)
+  -> add_block_from_peer ở node khác (id khi ghi chỉ mục + id khi dọn mempool).
+
+Chạy: python benchmarks/bench_tx_record.py [số_giao_dịch]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sok.mempool import transaction_id
+from sok.transaction import TxRecord
+from sok.wallet import Wallet
+
+ID_LOOKUPS = 4  # Số lần cần tới mã giao dịch trên đường đi ở trên
+
+def make_transactions(count: int):
+    pem = Wallet().get_public_key_pem()
+    return [{'sender_public_key_pem': pem, 'sender_address': f"SO{i:064x}K", 'recipient_address': f"SO{i + 1:064x}K",
+             'amount': 1.5 + i, 'timestamp': 1700000000.0 + i, 'signature': "ab" * 256} for i in range(count)]
+
+def dict_path(transactions):
+    for tx in transactions:
+        len(json.dumps(tx))
+        for _ in range(ID_LOOKUPS): transaction_id(tx)
+
+def record_path(transactions):
+    for tx in transactions:
+        record = TxRecord(tx)
+        record.size
+        for _ in range(ID_LOOKUPS): record.id
+
+def measure(func, transactions, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(transactions)
+        best = min(best, time.perf_counter() - started)
+    return best / len(transactions) * 1e6
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    transactions = make_transactions(count)
+    dict_us, record_us = measure(dict_path, transactions), measure(record_path, transactions)
+    print(f"{count} giao dịch, {ID_LOOKUPS} lần cần mã giao dịch mỗi giao dịch")
+    print(f"  dict + transaction_id : {dict_us:8.2f} µs/giao dịch")
+    print(f"  TxRecord              : {record_us:8.2f} µs/giao dịch")
+    print(f"  nhanh hơn             : {dict_us / record_us:8.2f}x")
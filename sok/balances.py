@@ -0,0 +1,51 @@
+# sok/balances.py
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable
+
+class SpendableBalances:
+    """
+    Số dư khả dụng trong bộ nhớ, dùng khi nhận giao dịch vào mempool.
+
+    khả dụng = số dư đã xác nhận - tổng số tiền người gửi đang chờ chi trong mempool.
+
+    Số dư đã xác nhận được đệm LRU (tối đa `maxsize` địa chỉ) và chỉ đọc từ CSDL khi
+    trượt bộ đệm. Sau mỗi khối được commit, `evict` bỏ các địa chỉ mà khối làm thay đổi
+    để lần đọc sau nạp lại từ CSDL (cộng dồn thay đổi vào bộ đệm dễ bị tính hai lần nếu
+    một lần nạp đã thấy khối vừa commit); phần chờ chi do Mempool tự theo dõi khi thêm/xóa
+    giao dịch. Vì vậy việc nhận một giao dịch thường không cần truy vấn CSDL.
+    Tiền sắp nhận trong mempool không được tính (cách nhìn thận trọng).
+    """
+    def __init__(self, loader: Callable[[Iterable[str]], Dict[str, float]], pending_debit: Callable[[str], float], maxsize: int):
+        self._loader = loader
+        self._pending_debit = pending_debit
+        self.maxsize = maxsize
+        self._confirmed: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def confirmed(self, address: str) -> float:
+        # Nạp khi trượt được thực hiện trong khóa nên evict() sau commit luôn bỏ được giá trị cũ.
+        with self._lock:
+            if address in self._confirmed:
+                self._confirmed.move_to_end(address)
+                return self._confirmed[address]
+            balance = self._loader([address]).get(address, 0.0)
+            self._confirmed[address] = balance
+            while len(self._confirmed) > self.maxsize:
+                self._confirmed.popitem(last=False)
+            return balance
+
+    def spendable(self, address: str) -> float:
+        return self.confirmed(address) - self._pending_debit(address)
+
+    def evict(self, addresses: Iterable[str]):
+        """Bỏ các địa chỉ có số dư vừa thay đổi, sau khi khối chứa thay đổi đó đã được commit."""
+        with self._lock:
+            for address in addresses: self._confirmed.pop(address, None)
+
+    def clear(self):
+        """Bỏ toàn bộ bộ đệm (sau khi chuyển nhánh hoặc khởi động từ ảnh chụp)."""
+        with self._lock:
+            self._confirmed.clear()
@@ -0,0 +1,109 @@
+# sok/block.py
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import struct
+import zlib
+from typing import List, Optional, Any, Dict
+from .utils import hash_data
+from .mining import NONCE_STRUCT
+from .transaction import TxRecord
+
+# Header khối có kích thước cố định 92 byte:
+# index (u64) | previous_hash (32 byte) | timestamp (f64) | merkle_root (32 byte) | difficulty (u32) | nonce (u64).
+# Độ khó nằm trong phần được băm nên PoW gắn với độ khó mà khối công bố.
+# Nonce nằm cuối cùng nên PoW chỉ phải băm lại 8 byte sau một tiền tố cố định.
+HEADER_STRUCT = struct.Struct('>Q32sd32sI')
+EMPTY_MERKLE_ROOT = "0" * 64
+
+def compute_merkle_root(transactions: List[Dict]) -> str:
+    """Gốc Merkle (SHA256) của danh sách giao dịch; lá là hash_data của từng giao dịch."""
+    if not transactions: return EMPTY_MERKLE_ROOT
+    level = [bytes.fromhex(hash_data(tx)) for tx in transactions]
+    while len(level) > 1:
+        if len(level) % 2: level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+# Mã hóa thân khối (phiên bản 1): khóa công khai PEM được gom vào một bảng và giao dịch
+# chỉ giữ chỉ số tới bảng đó; sau đó JSON gọn (không khoảng trắng) được nén bằng zlib.
+BODY_FORMAT_V1 = b'\x01'
+
+def encode_block_body(transactions: List[Dict]) -> bytes:
+    keys: Dict[str, int] = {}
+    compact = []
+    for tx in transactions:
+        pem = tx.get('sender_public_key_pem')
+        if isinstance(pem, str) and pem != "0":
+            tx = dict(tx, sender_public_key_pem=keys.setdefault(pem, len(keys)))
+        compact.append(tx)
+    payload = json.dumps({'k': list(keys), 't': compact}, separators=(',', ':'))
+    return BODY_FORMAT_V1 + zlib.compress(payload.encode('utf-8'), 6)
+
+def decode_block_body(body: bytes) -> List[Dict]:
+    if body[:1] != BODY_FORMAT_V1: raise ValueError("Định dạng thân khối không được hỗ trợ.")
+    try: payload = json.loads(zlib.decompress(body[1:]))
+    except zlib.error as e: raise ValueError(f"Thân khối bị hỏng: {e}")
+    keys = payload['k']
+    transactions = payload['t']
+    for tx in transactions:
+        if isinstance(tx.get('sender_public_key_pem'), int):
+            tx['sender_public_key_pem'] = keys[tx['sender_public_key_pem']]
+    return transactions
+
+class Block:
+    def __init__(self, index: int, previous_hash: str, timestamp: float, transactions: List[Dict], nonce: int = 0, merkle_root: Optional[str] = None, difficulty: int = 0):
+        self.index: int = index
+        self.previous_hash: str = previous_hash
+        self.timestamp: float = timestamp
+        self._transactions: Optional[List[Dict]] = transactions
+        self._body: Optional[bytes] = None
+        self._records: Optional[List[TxRecord]] = None
+        self.nonce: int = nonce
+        # Độ khó mà khối phải đạt; mọi node tự tính lại nó từ dấu thời gian và đối chiếu với giá trị trong header.
+        self.difficulty: int = difficulty
+        self.merkle_root: str = merkle_root or compute_merkle_root(transactions)
+        self.hash: str = self.calculate_hash()
+    @property
+    def transactions(self) -> List[Dict]:
+        # Thân khối đọc từ CSDL chỉ được giải mã khi thực sự cần tới giao dịch.
+        if self._transactions is None:
+            self._transactions = decode_block_body(self._body)
+            self._body = None
+        return self._transactions
+    def tx_records(self) -> List[TxRecord]:
+        # Mã giao dịch của khối chỉ được tính một lần, dùng chung cho xác thực, ghi CSDL và dọn mempool.
+        if self._records is None:
+            self._records = [TxRecord(tx) for tx in self.transactions]
+        return self._records
+    def header_prefix(self) -> bytes:
+        return HEADER_STRUCT.pack(self.index, bytes.fromhex(self.previous_hash), float(self.timestamp), bytes.fromhex(self.merkle_root), self.difficulty)
+    def calculate_hash(self) -> str:
+        # Chỉ số/độ khó/nonce âm hoặc vượt kích thước trường làm struct.error; đổi sang ValueError để mọi nơi dựng
+        # khối từ dữ liệu peer (vốn đã bắt KeyError/TypeError/ValueError) loại khối thay vì sập.
+        try: header = self.header_prefix() + NONCE_STRUCT.pack(self.nonce)
+        except struct.error as e: raise ValueError(f"Header khối không hợp lệ: {e}") from e
+        return hashlib.sha256(header).hexdigest()
+    def has_valid_merkle_root(self) -> bool:
+        return self.merkle_root == compute_merkle_root(self.transactions)
+    def header_dict(self) -> Dict[str, Any]:
+        return {'index': self.index, 'hash': self.hash, 'previous_hash': self.previous_hash, 'timestamp': self.timestamp, 'nonce': self.nonce, 'merkle_root': self.merkle_root, 'difficulty': self.difficulty}
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.header_dict(), 'transactions': self.transactions}
+    @staticmethod
+    def from_dict(block_data: Dict[str, Any]) -> 'Block':
+        return Block(index=block_data['index'], previous_hash=block_data['previous_hash'], timestamp=block_data['timestamp'], transactions=block_data['transactions'], nonce=block_data['nonce'], merkle_root=block_data.get('merkle_root'), difficulty=block_data.get('difficulty', 0))
+    @staticmethod
+    def from_records(index: int, previous_hash: str, timestamp: float, records: List[TxRecord], nonce: int = 0, difficulty: int = 0) -> 'Block':
+        block = Block(index, previous_hash, timestamp, [record.data for record in records], nonce, difficulty=difficulty)
+        block._records = list(records)
+        return block
+    @staticmethod
+    def from_row(row: Any) -> 'Block':
+        """Dựng khối từ một dòng của bảng blocks mà không giải mã thân khối hay băm lại header."""
+        block = Block.__new__(Block)
+        block.index, block.previous_hash, block.timestamp = row['index'], row['previous_hash'], row['timestamp']
+        block.nonce, block.merkle_root, block.hash, block.difficulty = row['nonce'], row['merkle_root'], row['hash'], row['difficulty']
+        block._transactions, block._body, block._records = None, row['body'], None
+        return block
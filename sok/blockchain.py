@@ -8,46 +8,90 @@ import os
 import sqlite3
 import threading
 import logging  # <-- SỬA LỖI: THÊM DÒNG NÀY
-from typing import List, Optional, Any, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Any, Dict, Iterable, Iterator, NamedTuple, Tuple, Union
 from urllib.parse import urlparse
-from .utils import Config, hash_data
-
-class Block:
-    # Lớp Block giữ nguyên
-    def __init__(self, index: int, previous_hash: str, timestamp: float, transactions: List[Dict], nonce: int = 0):
-        self.index: int = index
-        self.previous_hash: str = previous_hash
-        self.timestamp: float = timestamp
-        self.transactions: List[Dict] = transactions
-        self.nonce: int = nonce
-        self.hash: str = self.calculate_hash()
-    def calculate_hash(self) -> str:
-        block_data = { 'index': self.index, 'previous_hash': self.previous_hash, 'timestamp': self.timestamp, 'transactions': self.transactions, 'nonce': self.nonce }
-        return hash_data(block_data)
-    def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
-    @staticmethod
-    def from_dict(block_data: Dict[str, Any]) -> 'Block':
-        return Block(index=block_data['index'], previous_hash=block_data['previous_hash'], timestamp=block_data['timestamp'], transactions=block_data['transactions'], nonce=block_data['nonce'])
+from .utils import Config
+from .mining import MiningEngine, MiningResult, DifficultySchedule, block_work
+from .block import Block, encode_block_body, decode_block_body
+from .validation import ChainValidator, BlockValidator, is_transaction_list, check_system_transactions, apply_balance_overlay
+from .storage import Storage
+from .snapshot import canonical_balances, compute_snapshot_commitment, encode_snapshot, decode_snapshot
+from .mempool import Mempool
+from .balances import SpendableBalances
+from .transaction import TxRecord, forget_verified_signature
+
+# Phiên bản lược đồ CSDL (PRAGMA user_version); _migrate_schema chỉ chạy khi CSDL cũ hơn.
+#   0: CSDL gốc (thân khối JSON trong cột `transactions`) hoặc CSDL mới tạo
+#   2: thân khối nén trong cột `body`, header 88 byte, nhật ký hoàn tác, chỉ mục giao dịch, ảnh chụp
+#   3: độ khó lưu theo từng khối (cột `difficulty`)
+#   4: bảng chain_meta lưu độ cao kích hoạt của lịch sử đã chuyển đổi
+#   5: độ khó nằm trong header được băm (header 92 byte)
+SCHEMA_VERSION = 5
+HEADER_COLUMNS = ('index', 'hash', 'previous_hash', 'timestamp', 'nonce', 'merkle_root', 'difficulty')
+# Khối gốc của một node khởi động từ ảnh chụp chỉ có header; thân khối được để trống.
+PRUNED_BODY = b''
+
+def compute_balance_deltas(transactions: List[Dict]) -> Dict[str, float]:
+    """Thay đổi số dư ròng theo địa chỉ mà một khối gây ra."""
+    deltas: Dict[str, float] = {}
+    for tx in transactions:
+        sender_addr = tx.get('sender_address')
+        recipient_addr = tx.get('recipient_address')
+        amount = float(tx.get('amount', 0))
+        # Không trừ tiền từ địa chỉ "0" (giao dịch thưởng/genesis)
+        if sender_addr and sender_addr != "0":
+            deltas[sender_addr] = deltas.get(sender_addr, 0.0) - amount
+        if recipient_addr:
+            deltas[recipient_addr] = deltas.get(recipient_addr, 0.0) + amount
+    return deltas
+
+class ChainTip(NamedTuple):
+    """Header của khối đỉnh chuỗi, được giữ trong bộ nhớ, kèm công việc tích lũy (tổng block_work) tới khối đó."""
+    index: int
+    hash: str
+    timestamp: float
+    work: int
 
 class Blockchain:
-    def __init__(self, db_path: str, difficulty: Optional[int] = None):
-        self.pending_transactions: List[Dict] = []
-        self.difficulty: int = difficulty if difficulty is not None else Config.DIFFICULTY
+    def __init__(self, db_path: str, difficulty: Optional[int] = None, mining_workers: Optional[int] = None):
+        self.mempool = Mempool(Config.MEMPOOL_MAX_TRANSACTIONS, Config.MEMPOOL_MAX_BYTES, Config.MEMPOOL_MAX_PER_SENDER,
+                               on_evict=lambda tx_id, tx: forget_verified_signature(tx_id, tx.get('signature')))
+        # Độ khó của khối đầu tiên; các khối sau theo lịch điều chỉnh (xem DifficultySchedule).
+        self.initial_difficulty: int = difficulty if difficulty is not None else Config.DIFFICULTY
+        self.mining_engine = MiningEngine(mining_workers if mining_workers is not None else Config.MINING_WORKERS)
+        self.last_mining_result: Optional[MiningResult] = None
+        self.block_validator = BlockValidator()
         self.peers: Dict[str, Dict[str, Any]] = {}
         self.peer_lock = threading.Lock()
         self.mining_lock = threading.Lock()
-        self.seen_transaction_hashes = set()
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row 
+        # Chỉ một luồng khai thác tại một thời điểm; PoW chạy ngoài mining_lock.
+        self._miner_lock = threading.Lock()
+        self._mining_parent: Optional[str] = None
+        self.storage = Storage(db_path, Config.DB_READ_POOL_SIZE)
+        self.spendable_balances = SpendableBalances(self._load_balances, self.mempool.pending_debit, Config.BALANCE_CACHE_SIZE)
         self._create_tables()
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT MAX("index") FROM blocks')
-        result = cursor.fetchone()
-        if result is None or result[0] is None:
+        # Độ cao kích hoạt: lấy mức cao hơn giữa Config và giá trị mà bước chuyển CSDL đã ghi lại.
+        meta = self._load_chain_meta()
+        self.retarget_height: int = max(Config.DIFFICULTY_RETARGET_HEIGHT, meta.get('difficulty_retarget_height', 0))
+        self.pow_height: int = max(Config.HEADER_HASH_ACTIVATION_HEIGHT, meta.get('header_hash_activation_height', 0))
+        self._base_work: int = self._base_work_from_meta(meta)
+        self._tip: Optional[ChainTip] = self._load_tip()
+        self.base_height: int = self._load_base_height()
+        # Khác None khi chuỗi trên đĩa không qua được xác thực lúc khởi động; API và kênh P2P trả 503.
+        self.integrity_error: Optional[str] = None
+        if self._tip is None:
             logging.info("Phát hiện cơ sở dữ liệu trống. Đang tạo khối Sáng thế (Genesis)...")
             self.create_genesis_block()
+        elif Config.VALIDATE_CHAIN_ON_STARTUP and not self.validate_local_chain():
+            self.integrity_error = f"Chuỗi trong {db_path} không hợp lệ (CSDL hỏng hoặc thiếu cấu hình độ cao kích hoạt cho lịch sử cũ)."
+            logging.critical(f"{self.integrity_error} Node từ chối phục vụ cho tới khi CSDL được sửa.")
     
+    @property
+    def pending_transactions(self) -> List[Dict]:
+        return self.mempool.transactions()
+
     def register_node(self, node_id: str, node_address: str) -> bool:
         with self.peer_lock:
             parsed_url = urlparse(node_address)
@@ -73,180 +117,739 @@ class Blockchain:
                 logging.info(f"[Blockchain] Đã học được về {new_peers_found} peer mới thông qua PEX.")
     
     def _create_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute(""" CREATE TABLE IF NOT EXISTS blocks ("index" INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, previous_hash TEXT NOT NULL, timestamp REAL NOT NULL, nonce INTEGER NOT NULL, transactions TEXT NOT NULL) """)
+        with self.storage.write() as cursor:
+            self._migrate_schema(cursor)
+
+    def _migrate_schema(self, cursor: sqlite3.Cursor):
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION: return
+        if version > SCHEMA_VERSION: raise ValueError(f"CSDL dùng lược đồ phiên bản {version}, mới hơn phiên bản hỗ trợ ({SCHEMA_VERSION}).")
+        # Các bước dưới đây tự nhận biết bố cục cũ qua cột/bảng hiện có nên chạy được từ mọi phiên bản trước.
+        conn = cursor.connection
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(blocks)")}
+        if 'transactions' in columns:
+            # CSDL cũ lưu thân khối dạng JSON: đổi tên bảng để chuyển sang định dạng nén bên dưới.
+            cursor.execute("ALTER TABLE blocks RENAME TO blocks_legacy")
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS blocks ("index" INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, previous_hash TEXT NOT NULL, timestamp REAL NOT NULL, nonce INTEGER NOT NULL, merkle_root TEXT NOT NULL, body BLOB NOT NULL, difficulty INTEGER NOT NULL) """)
+        fixed_difficulty_height = None
+        if columns and 'transactions' not in columns and 'difficulty' not in columns:
+            # Các khối trước khi có điều chỉnh độ khó đều được đào với độ khó cố định.
+            cursor.execute(f"ALTER TABLE blocks ADD COLUMN difficulty INTEGER NOT NULL DEFAULT {int(self.initial_difficulty)}")
+            fixed_difficulty_height = cursor.execute('SELECT MAX("index") FROM blocks').fetchone()[0]
+        if 'transactions' in columns:
+            # Mã băm cũ là SHA256 của JSON cả khối nên không khớp header 92 byte: tính lại mã băm header
+            # (và gốc Merkle nếu thiếu) rồi nối lại previous_hash theo mã băm mới. PoW của các khối này
+            # nằm trên mã băm cũ nên độ cao kích hoạt PoW được ghi vào chain_meta bên dưới.
+            previous_hash = Config.GENESIS_PREVIOUS_HASH
+            for row in conn.execute('SELECT * FROM blocks_legacy ORDER BY "index"'):
+                transactions = json.loads(row['transactions'])
+                merkle_root = row['merkle_root'] if 'merkle_root' in columns and row['merkle_root'] else None
+                block = Block(row['index'], previous_hash, row['timestamp'], transactions, row['nonce'], merkle_root, self.initial_difficulty)
+                cursor.execute('INSERT INTO blocks ("index", hash, previous_hash, timestamp, nonce, merkle_root, body, difficulty) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (block.index, block.hash, block.previous_hash, block.timestamp, block.nonce, block.merkle_root, encode_block_body(transactions), block.difficulty))
+                previous_hash = block.hash
+            cursor.execute("DROP TABLE blocks_legacy")
+            fixed_difficulty_height = cursor.execute('SELECT MAX("index") FROM blocks').fetchone()[0]
+            logging.info("[Blockchain] Đã chuyển thân khối sang định dạng nén.")
+        # Độ cao kích hoạt của lịch sử đã chuyển đổi được lưu ngay trong CSDL (cạnh user_version)
+        # để node mở lại chuỗi này với cấu hình mặc định; mỗi khóa chỉ tăng, không giảm.
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS chain_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) """)
+        legacy_meta = {}
+        if fixed_difficulty_height is not None:
+            legacy_meta['difficulty_retarget_height'] = fixed_difficulty_height + 1
+            if 'transactions' in columns: legacy_meta['header_hash_activation_height'] = fixed_difficulty_height + 1
+        cursor.executemany("INSERT INTO chain_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)", legacy_meta.items())
+        if legacy_meta: logging.info(f"[Blockchain] Đã ghi độ cao kích hoạt cho lịch sử cũ: {legacy_meta}.")
+        if columns and 'transactions' not in columns and version < 5:
+            self._rehash_headers(cursor)
         cursor.execute(""" CREATE TABLE IF NOT EXISTS balances (address TEXT PRIMARY KEY, balance REAL NOT NULL) """)
-        self.conn.commit()
+        # Nhật ký hoàn tác: thay đổi số dư mà mỗi khối đã gây ra, dùng để lùi khối khi rẽ nhánh.
+        has_journal = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_deltas'").fetchone()
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS balance_deltas (block_index INTEGER NOT NULL, address TEXT NOT NULL, delta REAL NOT NULL, PRIMARY KEY (block_index, address)) """)
+        if not has_journal:
+            for row in conn.execute('SELECT "index", body FROM blocks'):
+                deltas = compute_balance_deltas(decode_block_body(row['body']))
+                cursor.executemany("INSERT INTO balance_deltas (block_index, address, delta) VALUES (?, ?, ?)", [(row['index'], address, delta) for address, delta in deltas.items()])
+        # Chỉ mục giao dịch theo id và theo địa chỉ, phục vụ tra cứu lịch sử không cần quét bảng blocks.
+        has_tx_index = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tx'").fetchone()
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS tx (id TEXT NOT NULL, block_index INTEGER NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (block_index, position)) """)
+        cursor.execute(""" CREATE INDEX IF NOT EXISTS tx_id_idx ON tx (id) """)
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS address_tx (address TEXT NOT NULL, block_index INTEGER NOT NULL, position INTEGER NOT NULL, tx_id TEXT NOT NULL, PRIMARY KEY (address, block_index, position)) """)
+        cursor.execute(""" CREATE INDEX IF NOT EXISTS address_tx_block_idx ON address_tx (block_index) """)
+        if not has_tx_index:
+            for row in conn.execute('SELECT "index", body FROM blocks'):
+                self._index_transactions(cursor, row['index'], [TxRecord(tx) for tx in decode_block_body(row['body'])])
+        # Ảnh chụp số dư định kỳ kèm cam kết băm, dùng để khởi động nhanh node mới.
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS snapshots (height INTEGER PRIMARY KEY, block_hash TEXT NOT NULL, commitment TEXT NOT NULL, created_at REAL NOT NULL, data BLOB NOT NULL) """)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def _rehash_headers(cursor: sqlite3.Cursor):
+        """
+        Lên lược đồ 5 (độ khó nằm trong header): tính lại mã băm mọi khối, nối lại previous_hash
+        và cam kết của các ảnh chụp. PoW của các khối này nằm trên header cũ nên độ cao kích hoạt
+        PoW được nâng lên sau đỉnh hiện tại.
+        """
+        rows = cursor.execute('SELECT "index", previous_hash, timestamp, nonce, merkle_root, difficulty FROM blocks ORDER BY "index"').fetchall()
+        if not rows: return
+        new_hashes, previous_hash = {}, rows[0]['previous_hash']
+        for row in rows:
+            block = Block(row['index'], previous_hash, row['timestamp'], [], row['nonce'], row['merkle_root'], row['difficulty'])
+            cursor.execute('UPDATE blocks SET hash = ?, previous_hash = ? WHERE "index" = ?', (block.hash, previous_hash, block.index))
+            new_hashes[block.index] = previous_hash = block.hash
+        for snap in cursor.execute("SELECT height, data FROM snapshots").fetchall():
+            block_hash = new_hashes.get(snap['height'])
+            if block_hash is None: continue
+            commitment = compute_snapshot_commitment(snap['height'], block_hash, decode_snapshot(snap['data']))
+            cursor.execute("UPDATE snapshots SET block_hash = ?, commitment = ? WHERE height = ?", (block_hash, commitment, snap['height']))
+        tip_index = rows[-1]['index']
+        cursor.execute("INSERT INTO chain_meta (key, value) VALUES ('header_hash_activation_height', ?) ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)", (tip_index + 1,))
+        logging.info(f"[Blockchain] Đã tính lại mã băm header (kèm độ khó) cho {len(rows)} khối tới #{tip_index}.")
+        if rows[0]['index'] > 0:
+            # Khối trước khối gốc ảnh chụp không có trong CSDL nên liên kết của khối gốc không thể tính lại.
+            logging.warning(f"[Blockchain] Khối gốc ảnh chụp #{rows[0]['index']} vẫn trỏ tới mã băm cũ; khởi động lại node từ ảnh chụp để khớp với peer.")
+
+    def _load_tip(self) -> Optional[ChainTip]:
+        with self.storage.read() as conn:
+            row = conn.execute('SELECT "index", hash, timestamp FROM blocks ORDER BY "index" DESC LIMIT 1').fetchone()
+            if not row: return None
+            work = self._base_work + self._work_between(conn, 0, row['index'])
+        return ChainTip(row['index'], row['hash'], row['timestamp'], work)
+
+    @staticmethod
+    def _work_between(conn: Union[sqlite3.Connection, sqlite3.Cursor], start: int, end: int) -> int:
+        """Tổng block_work của các khối có chỉ số trong [start, end], gom theo độ khó."""
+        rows = conn.execute('SELECT difficulty, COUNT(*) AS count FROM blocks WHERE "index" BETWEEN ? AND ? GROUP BY difficulty', (start, end))
+        return sum(block_work(row['difficulty']) * row['count'] for row in rows)
+
+    @staticmethod
+    def _base_work_from_meta(meta: Dict[str, int]) -> int:
+        # Node khởi động từ ảnh chụp không lưu các khối trước khối gốc; số khối theo từng độ khó
+        # của đoạn đó được ghi trong chain_meta (base_blocks_difficulty_<d>) lúc khởi động.
+        return sum(block_work(int(key.rsplit('_', 1)[1])) * count for key, count in meta.items() if key.startswith('base_blocks_difficulty_'))
+
+    def _load_chain_meta(self) -> Dict[str, int]:
+        with self.storage.read() as conn:
+            return {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM chain_meta")}
+
+    def _load_base_height(self) -> int:
+        # 0 với chuỗi đầy đủ; độ cao của ảnh chụp nếu node được khởi động từ ảnh chụp.
+        with self.storage.read() as conn:
+            row = conn.execute('SELECT MIN("index") FROM blocks').fetchone()
+        return row[0] or 0
+
+    @property
+    def _first_full_block(self) -> int:
+        return self.base_height + 1 if self.base_height > 0 else 0
+
+    @property
+    def tip(self) -> ChainTip:
+        # Đọc đỉnh chuỗi từ bộ nhớ; phép gán self._tip là nguyên tử nên không cần khóa.
+        tip = self._tip
+        if tip is None: raise Exception("Không tìm thấy khối nào trong cơ sở dữ liệu!")
+        return tip
+
     @property
     def last_block(self) -> Block:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM blocks ORDER BY "index" DESC LIMIT 1')
-        row = cursor.fetchone()
+        with self.storage.read() as conn:
+            row = conn.execute('SELECT * FROM blocks WHERE "index" = ?', (self.tip.index,)).fetchone()
         if not row: raise Exception("Không tìm thấy khối nào trong cơ sở dữ liệu!")
-        # Đảm bảo transactions được load đúng cách
-        block_dict = dict(row)
-        if isinstance(block_dict['transactions'], str):
-            block_dict['transactions'] = json.loads(block_dict['transactions'])
-        return Block.from_dict(block_dict)
+        return Block.from_row(row)
         
+    def _apply_block(self, cursor: sqlite3.Cursor, block: Block) -> Dict[str, float]:
+        """Ghi khối và cập nhật số dư trong giao dịch SQLite hiện tại (chưa commit); trả về thay đổi số dư."""
+        cursor.execute('INSERT INTO blocks ("index", hash, previous_hash, timestamp, nonce, merkle_root, body, difficulty) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', 
+                       (block.index, block.hash, block.previous_hash, block.timestamp, block.nonce, block.merkle_root, encode_block_body(block.transactions), block.difficulty))
+
+        all_recipients = {tx.get('recipient_address') for tx in block.transactions if tx.get('recipient_address')}
+        if all_recipients: 
+            cursor.executemany("INSERT OR IGNORE INTO balances (address, balance) VALUES (?, ?)", [(recipient, 0.0) for recipient in all_recipients])
+
+        deltas = compute_balance_deltas(block.transactions)
+        if deltas:
+            cursor.executemany("UPDATE balances SET balance = balance + ? WHERE address = ?", [(delta, address) for address, delta in deltas.items()])
+            cursor.executemany("INSERT INTO balance_deltas (block_index, address, delta) VALUES (?, ?, ?)", [(block.index, address, delta) for address, delta in deltas.items()])
+        self._index_transactions(cursor, block.index, block.tx_records())
+        if block.index > 0 and block.index % Config.SNAPSHOT_INTERVAL == 0:
+            self._write_snapshot(cursor, block.index, block.hash)
+        return deltas
+
+    @staticmethod
+    def _write_snapshot(cursor: sqlite3.Cursor, height: int, block_hash: str):
+        balances = canonical_balances((row['address'], row['balance']) for row in cursor.execute("SELECT address, balance FROM balances"))
+        commitment = compute_snapshot_commitment(height, block_hash, balances)
+        cursor.execute("INSERT OR REPLACE INTO snapshots (height, block_hash, commitment, created_at, data) VALUES (?, ?, ?, ?, ?)", (height, block_hash, commitment, time.time(), encode_snapshot(balances)))
+        cursor.execute("DELETE FROM snapshots WHERE height NOT IN (SELECT height FROM snapshots ORDER BY height DESC LIMIT ?)", (Config.SNAPSHOT_RETAIN,))
+        logging.info(f"[Snapshot] Đã ghi ảnh chụp số dư tại khối #{height} ({len(balances)} địa chỉ).")
+
+    @staticmethod
+    def _index_transactions(cursor: sqlite3.Cursor, block_index: int, records: List[TxRecord]):
+        tx_rows, address_rows = [], []
+        for position, record in enumerate(records):
+            tx_rows.append((record.id, block_index, position))
+            # Không lập chỉ mục cho địa chỉ hệ thống "0" (giao dịch thưởng/genesis).
+            for address in {record.sender, record.data.get('recipient_address')} - {None, "", "0"}:
+                address_rows.append((address, block_index, position, record.id))
+        cursor.executemany("INSERT INTO tx (id, block_index, position) VALUES (?, ?, ?)", tx_rows)
+        cursor.executemany("INSERT INTO address_tx (address, block_index, position, tx_id) VALUES (?, ?, ?, ?)", address_rows)
+
+    def _undo_block(self, cursor: sqlite3.Cursor, index: int) -> List[TxRecord]:
+        """Lùi khối `index` bằng nhật ký hoàn tác (chưa commit); trả về các giao dịch của khối."""
+        if 0 < self.base_height and index <= self.base_height: raise ValueError(f"Không thể lùi qua khối gốc ảnh chụp #{self.base_height}.")
+        row = cursor.execute('SELECT body FROM blocks WHERE "index" = ?', (index,)).fetchone()
+        if not row: raise ValueError(f"Không tìm thấy khối #{index} để hoàn tác.")
+        deltas = cursor.execute("SELECT address, delta FROM balance_deltas WHERE block_index = ?", (index,)).fetchall()
+        cursor.executemany("UPDATE balances SET balance = balance - ? WHERE address = ?", [(d['delta'], d['address']) for d in deltas])
+        cursor.execute("DELETE FROM balance_deltas WHERE block_index = ?", (index,))
+        cursor.execute("DELETE FROM tx WHERE block_index = ?", (index,))
+        cursor.execute("DELETE FROM address_tx WHERE block_index = ?", (index,))
+        cursor.execute("DELETE FROM snapshots WHERE height = ?", (index,))
+        cursor.execute('DELETE FROM blocks WHERE "index" = ?', (index,))
+        return [TxRecord(tx) for tx in decode_block_body(row['body'])]
+
     def _add_block_to_db(self, block: Block):
         try:
-            cursor = self.conn.cursor()
-            
-            # Chuyển transactions sang chuỗi JSON để lưu
-            transactions_json = json.dumps([tx for tx in block.transactions])
-
-            cursor.execute('INSERT INTO blocks ("index", hash, previous_hash, timestamp, nonce, transactions) VALUES (?, ?, ?, ?, ?, ?)', 
-                           (block.index, block.hash, block.previous_hash, block.timestamp, block.nonce, transactions_json))
-
-            senders_to_update, recipients_to_update, new_recipients_data = [], [], []
-            all_recipients = {tx.get('recipient_address') for tx in block.transactions if tx.get('recipient_address')}
-            
-            for recipient in all_recipients: 
-                new_recipients_data.append((recipient, 0.0))
-            if new_recipients_data: 
-                cursor.executemany("INSERT OR IGNORE INTO balances (address, balance) VALUES (?, ?)", new_recipients_data)
-
-            for tx in block.transactions:
-                sender_addr = tx.get('sender_address')
-                recipient_addr = tx.get('recipient_address')
-                amount = float(tx.get('amount', 0))
-                
-                # Không trừ tiền từ địa chỉ "0" (giao dịch thưởng/genesis)
-                if sender_addr and sender_addr != "0": 
-                    senders_to_update.append((amount, sender_addr))
-                if recipient_addr: 
-                    recipients_to_update.append((amount, recipient_addr))
-
-            if senders_to_update: 
-                cursor.executemany("UPDATE balances SET balance = balance - ? WHERE address = ?", senders_to_update)
-            if recipients_to_update: 
-                cursor.executemany("UPDATE balances SET balance = balance + ? WHERE address = ?", recipients_to_update)
-            
-            self.conn.commit()
+            with self.storage.write() as cursor:
+                deltas = self._apply_block(cursor, block)
         except Exception as e:
-            self.conn.rollback()
             logging.error(f"LỖI DB: Giao dịch cơ sở dữ liệu đã được hoàn tác. Lỗi: {e}")
             raise
+        # Chỉ công bố đỉnh mới sau khi giao dịch SQLite đã commit thành công.
+        parent_work = self._tip.work if self._tip is not None else self._base_work
+        self._set_tip(ChainTip(block.index, block.hash, block.timestamp, parent_work + block_work(block.difficulty)))
+        self.spendable_balances.evict(deltas)
 
-    def add_transaction(self, transaction: Dict) -> bool:
-        tx_content_for_hash = {k: v for k, v in transaction.items() if k not in ['signature', 'sender_address']}
-        tx_hash = hash_data(tx_content_for_hash)
-        if tx_hash in self.seen_transaction_hashes: return False
-        self.pending_transactions.append(transaction)
-        self.seen_transaction_hashes.add(tx_hash)
-        return True
+    def add_transaction(self, transaction: Union[Dict, TxRecord], tx_id: Optional[str] = None) -> bool:
+        """Nhận giao dịch vào mempool; từ chối nếu người gửi chi vượt số dư khả dụng (không truy vấn CSDL khi trúng bộ đệm)."""
+        record = transaction if isinstance(transaction, TxRecord) else TxRecord(transaction, tx_id)
+        if record.is_system: return self.mempool.add(record)
+        # Giao dịch đã được xác nhận trong chuỗi không được phát lại.
+        if self._confirmed_transaction_ids([record.id]): return False
+        return self.mempool.add(record, available=self.spendable_balances.confirmed(record.sender))
+
+    def get_spendable_balance(self, address: str) -> float:
+        """Số dư đã xác nhận trừ các khoản đang chờ chi trong mempool."""
+        return self.spendable_balances.spendable(address)
+
+    def _set_tip(self, tip: ChainTip):
+        """Cập nhật đỉnh chuỗi (khi đang giữ mining_lock); hủy PoW đang chạy trên đỉnh cũ."""
+        self._tip = tip
+        if self._mining_parent is not None and self._mining_parent != tip.hash:
+            self.mining_engine.abort()
+
+    def _build_block_template(self, miner_address: str) -> Block:
+        """Khối mẫu trên đỉnh hiện tại từ mempool (gọi khi đang giữ mining_lock)."""
+        reward_tx = { 'sender_public_key_pem': "0", 'sender_address': "0", 'recipient_address': miner_address, 'amount': self.get_current_mining_reward(), 'timestamp': time.time(), 'signature': "mining_reward" }
+        pending_records = self.mempool.records()
+        # Bỏ giao dịch hệ thống giả mạo và giao dịch làm người gửi bị âm số dư,
+        # để khối tự đào luôn qua được bước xác thực đầy đủ ở các node khác.
+        candidates = [record for record in pending_records if not record.is_system]
+        balances = self._load_balances({record.sender for record in candidates})
+        included = [record for record, ok in zip(candidates, apply_balance_overlay([record.data for record in candidates], balances)) if ok]
+        if len(included) < len(pending_records):
+            # Giao dịch không vào được khối sẽ không bao giờ hợp lệ trên đỉnh này: loại hẳn khỏi mempool.
+            included_ids = {record.id for record in included}
+            invalid_ids = [record.id for record in pending_records if record.id not in included_ids]
+            self.mempool.remove_many(invalid_ids)
+            logging.warning(f"[Mining] Đã loại {len(invalid_ids)} giao dịch không hợp lệ khỏi mempool: {', '.join(tx_id[:10] for tx_id in invalid_ids[:5])}{'...' if len(invalid_ids) > 5 else ''}")
+        last_b = self.tip
+        schedule = self._schedule_at(last_b.index + 1)
+        # Dấu thời gian phải lớn hơn trung vị các khối trước, kể cả khi đồng hồ cục bộ chậm hơn peer.
+        timestamp = max(time.time(), (schedule.median_time_past() or 0) + 0.001)
+        return Block.from_records(last_b.index + 1, last_b.hash, timestamp, [TxRecord(reward_tx)] + included, difficulty=schedule.expected(last_b.index + 1))
 
     def mine_pending_transactions(self, miner_address: str) -> Block:
-        with self.mining_lock:
-            reward_tx = { 'sender_public_key_pem': "0", 'sender_address': "0", 'recipient_address': miner_address, 'amount': self.get_current_mining_reward(), 'timestamp': time.time(), 'signature': "mining_reward" }
-            transactions_for_block = [reward_tx] + self.pending_transactions
-            last_b = self.last_block
-            new_block = Block(index=last_b.index + 1, previous_hash=last_b.hash, timestamp=time.time(), transactions=transactions_for_block)
-            self.proof_of_work(new_block)
-            self._add_block_to_db(new_block)
-            tx_hashes_in_block = {hash_data({k: v for k, v in tx.items() if k not in ['signature', 'sender_address']}) for tx in self.pending_transactions}
-            self.seen_transaction_hashes -= tx_hashes_in_block
-            self.pending_transactions = []
-            return new_block
+        """
+        Khai thác một khối mới. PoW chạy trên khối mẫu ngoài mining_lock nên khối từ peer
+        được chấp nhận ngay cả khi đang đào. Khi đỉnh chuỗi đổi, lượt PoW bị hủy và
+        khối mẫu được dựng lại trên đỉnh mới với mempool đã cập nhật.
+        """
+        with self._miner_lock:
+            while True:
+                with self.mining_lock:
+                    self.mining_engine.reset()
+                    new_block = self._build_block_template(miner_address)
+                    self._mining_parent = new_block.previous_hash
+                try: result = self.proof_of_work(new_block)
+                finally: self._mining_parent = None
+                with self.mining_lock:
+                    if result.found and self.tip.hash == new_block.previous_hash:
+                        self._add_block_to_db(new_block)
+                        # Chỉ xóa những giao dịch đã vào khối; giao dịch đến trong lúc đào vẫn được giữ lại.
+                        self.mempool.remove_many([record.id for record in new_block.tx_records()])
+                        return new_block
+                    tip = self.tip
+                logging.info(f"[Mining] Đỉnh chuỗi đã chuyển sang #{tip.index}, khai thác lại trên đỉnh mới.")
+
+    def _check_block(self, block_data: Dict, index: int, previous_hash: str, cursor: Optional[sqlite3.Cursor] = None) -> Optional[Block]:
+        """
+        Xác thực đầy đủ một khối nhận từ peer nối tiếp (index - 1, previous_hash); trả về Block nếu hợp lệ.
+        `cursor` là giao dịch ghi đang mở (khi chuyển nhánh) để đọc số dư chưa commit.
+        """
+        if block_data.get('index') != index or block_data.get('previous_hash') != previous_hash: return None
+        if not is_transaction_list(block_data.get('transactions')): return None
+        try: block = Block.from_dict(block_data)
+        except (KeyError, TypeError, ValueError): return None
+        # Kiểm tra riêng header (mã băm + PoW) và thân khối (gốc Merkle).
+        if block_data.get('hash') != block.hash: return None
+        schedule = self._schedule_at(index, cursor)
+        if not schedule.accepts_timestamp(block_data.get('timestamp')): return None
+        difficulty = schedule.expected(index)
+        if block.difficulty != difficulty: return None
+        if schedule.requires_proof_of_work(index) and not block.hash.startswith("0" * difficulty): return None
+        if not block.has_valid_merkle_root(): return None
+        if not self._check_block_transactions(block, cursor): return None
+        return block
+
+    def _check_block_transactions(self, block: Block, cursor: Optional[sqlite3.Cursor] = None) -> bool:
+        """
+        Kiểm tra giao dịch trong khối: giao dịch hệ thống, phát lại (trùng mã trong khối
+        hoặc đã xác nhận trong chuỗi), số dư (một truy vấn cho mọi người gửi rồi áp dụng
+        trên overlay trong bộ nhớ) và cuối cùng là chữ ký, phần tốn kém nhất, được xác
+        thực song song bởi BlockValidator.
+        """
+        transactions = block.transactions
+        if not check_system_transactions(transactions, block.index, self.mining_reward_at(block.index)): return False
+        tx_ids = [record.id for record in block.tx_records()]
+        if len(set(tx_ids)) != len(tx_ids) or self._confirmed_transaction_ids(tx_ids, cursor): return False
+        balances = self._load_balances({tx.get('sender_address') for tx in transactions if tx.get('sender_address') != "0"}, cursor)
+        if not all(apply_balance_overlay(transactions, balances)): return False
+        return self.block_validator.verify_signatures(block.tx_records())
+
+    def _load_balances(self, addresses: Iterable[str], cursor: Optional[sqlite3.Cursor] = None) -> Dict[str, float]:
+        """Số dư hiện tại của nhiều địa chỉ (mặc định 0.0), truy vấn theo lô thay vì từng địa chỉ."""
+        addresses = [address for address in addresses if isinstance(address, str)]
+        balances = dict.fromkeys(addresses, 0.0)
+        def query(conn):
+            for i in range(0, len(addresses), 500):
+                batch = addresses[i:i + 500]
+                for row in conn.execute(f"SELECT address, balance FROM balances WHERE address IN ({','.join('?' * len(batch))})", batch):
+                    balances[row['address']] = row['balance']
+        if cursor is not None: query(cursor)
+        else:
+            with self.storage.read() as conn: query(conn)
+        return balances
+
+    def _confirmed_transaction_ids(self, tx_ids: List[str], cursor: Optional[sqlite3.Cursor] = None) -> set:
+        """Các mã trong `tx_ids` đã nằm trong bảng tx (qua `cursor` nếu đang ở giữa giao dịch ghi)."""
+        found = set()
+        def query(conn):
+            for i in range(0, len(tx_ids), 500):
+                batch = tx_ids[i:i + 500]
+                found.update(row['id'] for row in conn.execute(f"SELECT id FROM tx WHERE id IN ({','.join('?' * len(batch))})", batch))
+        if cursor is not None: query(cursor)
+        else:
+            with self.storage.read() as conn: query(conn)
+        return found
 
     def add_block_from_peer(self, block_data: Dict) -> bool:
         with self.mining_lock:
-            last_b = self.last_block
-            if block_data.get('index') != last_b.index + 1 or block_data.get('previous_hash') != last_b.hash: return False
-            block = Block.from_dict(block_data)
-            if block.hash != block.calculate_hash(): return False
+            last_b = self.tip
+            block = self._check_block(block_data, last_b.index + 1, last_b.hash)
+            if block is None: return False
             self._add_block_to_db(block)
-            tx_hashes_in_block = {hash_data({k: v for k, v in tx.items() if k not in ['signature', 'sender_address']}) for tx in block.transactions}
-            self.pending_transactions = [tx for tx in self.pending_transactions if hash_data({k: v for k, v in tx.items() if k not in ['signature', 'sender_address']}) not in tx_hashes_in_block]
-            self.seen_transaction_hashes -= tx_hashes_in_block
+            self.mempool.remove_many([record.id for record in block.tx_records()])
         return True
 
     def create_genesis_block(self):
         genesis_tx = { 'sender_public_key_pem': "0", 'sender_address': "0", 'recipient_address': Config.FOUNDER_ADDRESS, 'amount': Config.INITIAL_SUPPLY_TOKENS, 'timestamp': time.time(), 'signature': "genesis_transaction" }
-        genesis_block = Block(index=0, previous_hash=Config.GENESIS_PREVIOUS_HASH, timestamp=time.time(), transactions=[genesis_tx], nonce=Config.GENESIS_NONCE)
+        genesis_block = Block(index=0, previous_hash=Config.GENESIS_PREVIOUS_HASH, timestamp=time.time(), transactions=[genesis_tx], nonce=Config.GENESIS_NONCE, difficulty=self.initial_difficulty)
         self._add_block_to_db(genesis_block)
         logging.info("✅ Khối Sáng thế đã được tạo và lưu vào SQLite.")
 
+    @staticmethod
+    def mining_reward_at(index: int) -> float:
+        return Config.MINING_REWARD / (2 ** (index // Config.HALVING_BLOCK_INTERVAL))
+
     def get_current_mining_reward(self) -> float:
-        halvings = (self.last_block.index + 1) // Config.HALVING_BLOCK_INTERVAL
-        return Config.MINING_REWARD / (2 ** halvings)
+        return self.mining_reward_at(self.tip.index + 1)
+
+    def proof_of_work(self, block: Block) -> MiningResult:
+        result = self.mining_engine.mine(block.header_prefix(), block.difficulty, start_nonce=block.nonce)
+        if result.found: block.nonce, block.hash = result.nonce, result.hash
+        self.last_mining_result = result
+        return result
 
-    def proof_of_work(self, block: Block):
-        target = "0" * self.difficulty
-        while not block.hash.startswith(target):
-            block.nonce += 1
-            block.hash = block.calculate_hash()
+    def _new_schedule(self) -> DifficultySchedule:
+        """Lịch độ khó rỗng theo độ cao kích hoạt của chuỗi này (Config + chain_meta)."""
+        return DifficultySchedule(self.initial_difficulty, self.retarget_height, self.pow_height)
+
+    def _schedule_at(self, index: int, cursor: Optional[sqlite3.Cursor] = None) -> DifficultySchedule:
+        """
+        Lịch độ khó cho khối `index` nối tiếp chuỗi trong CSDL; chỉ đọc khối đầu cửa sổ
+        điều chỉnh và MEDIAN_TIME_SPAN khối ngay trước `index`.
+        """
+        schedule = self._new_schedule()
+        if index == 0: return schedule
+        query = 'SELECT "index", timestamp, difficulty FROM blocks WHERE "index" = ? OR "index" BETWEEN ? AND ? ORDER BY "index"'
+        params = (index - Config.DIFFICULTY_ADJUSTMENT_INTERVAL, index - Config.MEDIAN_TIME_SPAN, index - 1)
+        if cursor is not None: rows = cursor.execute(query, params).fetchall()
+        else:
+            with self.storage.read() as conn: rows = conn.execute(query, params).fetchall()
+        for row in rows: schedule.push(row['index'], row['timestamp'], row['difficulty'])
+        return schedule
+
+    @property
+    def difficulty(self) -> int:
+        """Độ khó của khối kế tiếp."""
+        index = self.tip.index + 1
+        return self._schedule_at(index).expected(index)
 
     def get_balance(self, address: str) -> float:
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT balance FROM balances WHERE address = ?", (address,))
-        row = cursor.fetchone()
+        with self.storage.read() as conn:
+            row = conn.execute("SELECT balance FROM balances WHERE address = ?", (address,)).fetchone()
         return row['balance'] if row else 0.0
 
-    def get_full_chain_for_api(self) -> List[Dict]:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM blocks ORDER BY "index" ASC')
-        rows = cursor.fetchall()
-        chain = [dict(row) for row in rows]
-        return chain
-    
+    def get_transaction(self, tx_id: str) -> Optional[Dict]:
+        """Tra cứu giao dịch đã xác nhận theo id qua bảng chỉ mục `tx`."""
+        with self.storage.read() as conn:
+            row = conn.execute('SELECT tx.block_index, tx.position, blocks.hash, blocks.body FROM tx JOIN blocks ON blocks."index" = tx.block_index WHERE tx.id = ? ORDER BY tx.block_index ASC LIMIT 1', (tx_id,)).fetchone()
+        if not row: return None
+        return {'tx_id': tx_id, 'transaction': decode_block_body(row['body'])[row['position']], 'block_index': row['block_index'], 'block_hash': row['hash'], 'position': row['position'], 'confirmations': self.tip.index - row['block_index'] + 1}
+
+    def has_block(self, block_hash: str) -> bool:
+        with self.storage.read() as conn:
+            return conn.execute("SELECT 1 FROM blocks WHERE hash = ?", (block_hash,)).fetchone() is not None
+
+    def has_transaction(self, tx_id: str) -> bool:
+        """Giao dịch đang ở mempool hoặc đã được xác nhận trong chuỗi."""
+        if self.mempool.get(tx_id) is not None: return True
+        with self.storage.read() as conn:
+            return conn.execute("SELECT 1 FROM tx WHERE id = ? LIMIT 1", (tx_id,)).fetchone() is not None
+
+    def get_address_transactions(self, address: str, cursor: Optional[Tuple[int, int]] = None, limit: int = 50) -> Tuple[List[Dict], Optional[Tuple[int, int]]]:
+        """
+        Lịch sử giao dịch của một địa chỉ, mới nhất trước, phân trang theo con trỏ
+        (block_index, position) của mục cuối trang trước. Trả về (danh sách, con trỏ tiếp theo).
+        """
+        before = cursor or (self.tip.index + 1, 0)
+        with self.storage.read() as conn:
+            rows = conn.execute('SELECT block_index, position, tx_id FROM address_tx WHERE address = ? AND (block_index, position) < (?, ?) ORDER BY block_index DESC, position DESC LIMIT ?', (address, before[0], before[1], limit)).fetchall()
+            block_indexes = sorted({row['block_index'] for row in rows})
+            bodies = {r['index']: decode_block_body(r['body']) for r in conn.execute(f'SELECT "index", body FROM blocks WHERE "index" IN ({",".join("?" * len(block_indexes))})', block_indexes)} if rows else {}
+        history = [{'tx_id': row['tx_id'], 'block_index': row['block_index'], 'position': row['position'], 'transaction': bodies[row['block_index']][row['position']]} for row in rows]
+        next_cursor = (rows[-1]['block_index'], rows[-1]['position']) if len(rows) == limit else None
+        return history, next_cursor
+
     @staticmethod
-    def is_chain_valid(chain_to_validate: List[Dict]) -> bool:
-        if not chain_to_validate: return False
+    def _row_to_dict(row: sqlite3.Row, decode: bool = True) -> Dict:
+        block_data = {key: row[key] for key in HEADER_COLUMNS}
+        if decode: block_data['transactions'] = decode_block_body(row['body'])
+        else: block_data['body'] = row['body']
+        return block_data
+
+    def iter_block_range(self, start: int, limit: Optional[int] = None, headers_only: bool = False, batch_size: int = 500) -> Iterator[Dict]:
+        """
+        Đọc tối đa `limit` khối (None = tới đỉnh chuỗi) từ chỉ số `start`, phân trang trong SQL
+        theo khoảng chỉ số. Mỗi trang mượn kết nối đọc rồi trả lại ngay, nên một client đọc
+        chậm không giữ kết nối trong suốt quá trình truyền và bộ nhớ chỉ chứa một trang.
+        """
+        # Đường chỉ lấy header không đọc và không giải mã thân khối.
+        columns = ", ".join(f'"{c}"' for c in HEADER_COLUMNS) if headers_only else '*'
+        if not headers_only: start = max(start, self._first_full_block)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page = batch_size if remaining is None else min(batch_size, remaining)
+            with self.storage.read() as conn:
+                rows = conn.execute(f'SELECT {columns} FROM blocks WHERE "index" >= ? ORDER BY "index" ASC LIMIT ?', (start, page)).fetchall()
+            for row in rows: yield dict(row) if headers_only else self._row_to_dict(row)
+            if len(rows) < page: return
+            start = rows[-1]['index'] + 1
+            if remaining is not None: remaining -= len(rows)
+
+    def iter_blocks(self, start: int = 0, batch_size: int = 500, decode: bool = True):
+        """
+        Đọc lần lượt các khối từ CSDL theo từng lô, không tải toàn bộ chuỗi vào bộ nhớ.
+        Với decode=False, thân khối được trả nguyên dạng nén trong khóa 'body'.
+        """
+        with self.storage.read() as conn:
+            cursor = conn.execute('SELECT * FROM blocks WHERE "index" >= ? ORDER BY "index" ASC', (start,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows: return
+                for row in rows: yield self._row_to_dict(row, decode)
+
+    def validate_local_chain(self) -> bool:
+        """Xác thực toàn bộ chuỗi trên đĩa bằng bộ xác thực song song (gọi khi mở CSDL có sẵn)."""
+        # Thân khối được giải mã trong các tiến trình xác thực, không phải ở đây.
+        schedule = self._schedule_at(self._first_full_block)
+        previous_hash = Config.GENESIS_PREVIOUS_HASH
+        if self.base_height > 0:
+            if self.tip.index == self.base_height: return True
+            with self.storage.read() as conn:
+                previous_hash = conn.execute('SELECT hash FROM blocks WHERE "index" = ?', (self.base_height,)).fetchone()['hash']
+        with ChainValidator() as validator:
+            return validator.validate(self.iter_blocks(self._first_full_block, decode=False), self._first_full_block, previous_hash, schedule)
+
+    def _fetch_peer_tip(self, address: str) -> Optional[ChainTip]:
+        try:
+            response = requests.get(f'{address}/chain/tip', timeout=Config.SYNC_TIMEOUT_SECONDS)
+            if response.status_code != 200: return None
+            data = response.json()
+            return ChainTip(int(data['index']), str(data['hash']), float(data['timestamp']), int(data['work']))
+        except (requests.exceptions.RequestException, KeyError, TypeError, ValueError): return None
+
+    @staticmethod
+    def _fetch_block_range(address: str, start: int, limit: int, headers_only: bool = False) -> Optional[List[Dict]]:
+        params = {'start': start, 'limit': limit}
+        if headers_only: params['headers'] = 1
+        try:
+            response = requests.get(f'{address}/chain', params=params, timeout=Config.SYNC_TIMEOUT_SECONDS)
+            if response.status_code != 200: return None
+            blocks = response.json()['chain']
+        except (requests.exceptions.RequestException, KeyError, ValueError): return None
+        for block_data in blocks:
+            if isinstance(block_data.get('transactions'), str):
+                block_data['transactions'] = json.loads(block_data['transactions'])
+        # Chỉ chấp nhận đúng đoạn đã yêu cầu, liên tục và theo thứ tự.
+        if [b.get('index') for b in blocks] != list(range(start, start + len(blocks))) or not blocks: return None
+        return blocks
+
+    def _fetch_range_from_any(self, addresses: List[str], offset: int, start: int, limit: int, headers_only: bool = False) -> Optional[List[Dict]]:
+        # Mỗi đoạn ưu tiên một peer khác nhau; nếu peer đó lỗi thì thử lần lượt các peer còn lại.
+        for i in range(len(addresses)):
+            address = addresses[(offset + i) % len(addresses)]
+            blocks = self._fetch_block_range(address, start, limit, headers_only)
+            if blocks and len(blocks) == limit: return blocks
+        return None
+
+    def _stream_blocks(self, addresses: List[str], start: int, end: int, headers_only: bool = False):
+        """
+        Tải các khối [start, end] theo từng đoạn Config.SYNC_BATCH_SIZE, song song từ
+        nhiều peer, và trả ra từng khối theo đúng thứ tự. Số đoạn đang tải cùng lúc bị
+        giới hạn nên bộ nhớ không phụ thuộc vào độ dài chuỗi.
+        Ném ValueError nếu có đoạn không tải được từ bất kỳ peer nào.
+        """
+        ranges = [(s, min(Config.SYNC_BATCH_SIZE, end - s + 1)) for s in range(start, end + 1, Config.SYNC_BATCH_SIZE)]
+        window = max(1, Config.SYNC_MAX_PARALLEL)
+        executor = ThreadPoolExecutor(max_workers=window)
         try:
-            # Tải lại transactions từ chuỗi JSON nếu cần
-            for block_dict in chain_to_validate:
-                if isinstance(block_dict['transactions'], str):
-                    block_dict['transactions'] = json.loads(block_dict['transactions'])
-
-            genesis_block = Block.from_dict(chain_to_validate[0])
-            if genesis_block.index != 0 or genesis_block.previous_hash != Config.GENESIS_PREVIOUS_HASH: return False
-            for i in range(1, len(chain_to_validate)):
-                current_block, previous_block = Block.from_dict(chain_to_validate[i]), Block.from_dict(chain_to_validate[i-1])
-                if current_block.previous_hash != previous_block.hash: return False
-                if current_block.hash != current_block.calculate_hash(): return False
-        except (KeyError, TypeError, json.JSONDecodeError): return False
+            in_flight, next_range = deque(), 0
+            while next_range < len(ranges) or in_flight:
+                while next_range < len(ranges) and len(in_flight) < window:
+                    range_start, limit = ranges[next_range]
+                    in_flight.append(executor.submit(self._fetch_range_from_any, addresses, next_range, range_start, limit, headers_only))
+                    next_range += 1
+                blocks = in_flight.popleft().result()
+                if blocks is None: raise ValueError("Không tải được đoạn khối từ bất kỳ peer nào.")
+                yield from blocks
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _find_fork_point(self, addresses: List[str], local_tip: ChainTip, remote_tip: ChainTip) -> int:
+        """
+        Tìm khối chung cao nhất giữa chuỗi cục bộ và chuỗi của peer bằng cách so sánh
+        header theo từng đoạn, lùi dần từ đỉnh thấp hơn trong hai đỉnh (chuỗi nhiều công việc
+        hơn có thể ngắn hơn). Trả về -1 nếu không có khối chung (khác khối Sáng thế).
+        """
+        end = min(local_tip.index, remote_tip.index)
+        while end >= 0:
+            start = max(0, end - Config.SYNC_BATCH_SIZE + 1)
+            remote = self._fetch_range_from_any(addresses, 0, start, end - start + 1, headers_only=True)
+            if remote is None: raise ValueError("Không tải được header để tìm điểm rẽ nhánh.")
+            with self.storage.read() as conn:
+                local = {row['index']: row['hash'] for row in conn.execute('SELECT "index", hash FROM blocks WHERE "index" BETWEEN ? AND ?', (start, end))}
+            for header in reversed(remote):
+                if local.get(header['index']) == header.get('hash'): return header['index']
+            end = start - 1
+        return -1
+
+    def _reorganize(self, addresses: List[str], fork_point: int, best_tip: ChainTip) -> bool:
+        """
+        Chuyển sang nhánh của peer: lùi các khối sau điểm rẽ nhánh bằng nhật ký hoàn tác
+        rồi áp dụng nhánh mới khi tải về, tất cả trong một giao dịch SQLite duy nhất.
+        Nhánh mới chỉ được giữ nếu công việc tích lũy thực tế của nó lớn hơn nhánh hiện tại.
+        Các giao dịch bị bỏ lại ở nhánh cũ được đưa trở lại mempool.
+        """
+        with self.mining_lock:
+            orphaned: Dict[str, TxRecord] = {}
+            confirmed_ids: List[str] = []
+            local_tip = self.tip
+            try:
+                with self.storage.write() as cursor:
+                    work = local_tip.work - self._work_between(cursor, fork_point + 1, local_tip.index)
+                    for index in range(local_tip.index, fork_point, -1):
+                        for record in self._undo_block(cursor, index):
+                            if not record.is_system: orphaned[record.id] = record
+                    row = cursor.execute('SELECT hash FROM blocks WHERE "index" = ?', (fork_point,)).fetchone() if fork_point >= 0 else None
+                    previous_hash = row['hash'] if row else Config.GENESIS_PREVIOUS_HASH
+                    index = fork_point + 1
+                    for block_data in self._stream_blocks(addresses, fork_point + 1, best_tip.index):
+                        block = self._check_block(block_data, index, previous_hash, cursor)
+                        if block is None: raise ValueError(f"Khối #{index} của nhánh mới không hợp lệ.")
+                        self._apply_block(cursor, block)
+                        confirmed_ids.extend(record.id for record in block.tx_records())
+                        work += block_work(block.difficulty)
+                        previous_hash, index = block.hash, index + 1
+                    if previous_hash != best_tip.hash: raise ValueError("Nhánh tải về không kết thúc ở đỉnh đã công bố.")
+                    if work <= local_tip.work: raise ValueError("Nhánh tải về không có nhiều công việc tích lũy hơn nhánh hiện tại.")
+            except Exception as e:
+                logging.error(f"[Sync] Lỗi khi chuyển nhánh, đã hoàn tác: {e}")
+                return False
+            self._set_tip(ChainTip(block.index, block.hash, block.timestamp, work))
+            self.spendable_balances.clear()
+            self.mempool.remove_many(confirmed_ids)
+            for tx_id in confirmed_ids: orphaned.pop(tx_id, None)
+            for record in orphaned.values(): self.mempool.add(record)
+        logging.info(f"✅ Đã chuyển sang nhánh mới từ khối #{fork_point + 1}, đỉnh hiện tại #{self.tip.index}.")
         return True
 
     def resolve_conflicts(self) -> bool:
-        new_chain_data, max_length = None, self.last_block.index + 1
+        """
+        Đồng bộ theo kiểu headers-first:
+          1. Hỏi song song tất cả peer về đỉnh chuỗi (/chain/tip).
+          2. Chọn đỉnh có nhiều công việc tích lũy nhất (không phải cao nhất); các peer
+             cùng đỉnh đó chia nhau phục vụ việc tải.
+          3. Tìm điểm rẽ nhánh bằng cách so sánh header (/chain?headers=1).
+          4. Nếu chuỗi của peer nối tiếp đỉnh hiện tại, chỉ tải đoạn còn thiếu qua
+             /chain?start=&limit= và xác thực + ghi từng khối ngay khi nhận được.
+          5. Nếu bị rẽ nhánh, lùi các khối sau điểm rẽ nhánh và áp dụng nhánh mới
+             trong một giao dịch duy nhất.
+        """
+        local_tip = self.tip
         with self.peer_lock: peer_addresses = [peer_data['address'] for peer_data in self.peers.values()]
-        for address in peer_addresses:
+        if not peer_addresses: return False
+        with ThreadPoolExecutor(max_workers=min(len(peer_addresses), Config.SYNC_MAX_PARALLEL)) as executor:
+            peer_tips = [(address, tip) for address, tip in zip(peer_addresses, executor.map(self._fetch_peer_tip, peer_addresses)) if tip]
+        candidates = [tip for _, tip in peer_tips if tip.work > local_tip.work]
+        if not candidates: return False
+        best_tip = max(candidates, key=lambda tip: tip.work)
+        addresses = [address for address, tip in peer_tips if tip == best_tip]
+        logging.info(f"[Sync] Đỉnh tốt nhất #{best_tip.index} ({len(addresses)} peer, công việc {best_tip.work}), đỉnh cục bộ #{local_tip.index} (công việc {local_tip.work}).")
+
+        try: fork_point = self._find_fork_point(addresses, local_tip, best_tip)
+        except ValueError as e:
+            logging.warning(f"[Sync] {e}")
+            return False
+        if 0 < self.base_height and fork_point < self.base_height:
+            logging.warning(f"[Sync] Nhánh của peer rẽ ra trước khối gốc ảnh chụp #{self.base_height}, bỏ qua.")
+            return False
+        if fork_point == local_tip.index:
+            applied = 0
             try:
-                response = requests.get(f'{address}/chain', timeout=3)
-                if response.status_code == 200:
-                    length = response.json()['length']
-                    chain_from_node = response.json()['chain']
-                    if length > max_length and self.is_chain_valid(chain_from_node):
-                        max_length, new_chain_data = length, chain_from_node
-            except requests.exceptions.RequestException: continue
-        
-        if new_chain_data:
+                for block_data in self._stream_blocks(addresses, local_tip.index + 1, best_tip.index):
+                    if not self.add_block_from_peer(block_data):
+                        logging.warning(f"[Sync] Khối #{block_data.get('index')} không hợp lệ, dừng đồng bộ.")
+                        break
+                    applied += 1
+            except ValueError as e:
+                logging.warning(f"[Sync] {e}")
+            logging.info(f"[Sync] Đã nối thêm {applied} khối, đỉnh hiện tại #{self.tip.index}.")
+            return applied > 0
+
+        logging.info(f"[Sync] Phát hiện rẽ nhánh tại khối #{fork_point}, lùi {local_tip.index - fork_point} khối.")
+        return self._reorganize(addresses, fork_point, best_tip)
+
+    def list_snapshots(self) -> List[Dict]:
+        with self.storage.read() as conn:
+            return [dict(row) for row in conn.execute("SELECT height, block_hash, commitment, created_at FROM snapshots ORDER BY height DESC")]
+
+    def get_snapshot(self, height: Optional[int] = None) -> Optional[Dict]:
+        """Ảnh chụp tại `height` (hoặc mới nhất) kèm danh sách số dư đã giải nén."""
+        with self.storage.read() as conn:
+            if height is None: row = conn.execute("SELECT * FROM snapshots ORDER BY height DESC LIMIT 1").fetchone()
+            else: row = conn.execute("SELECT * FROM snapshots WHERE height = ?", (height,)).fetchone()
+        if not row: return None
+        return {'height': row['height'], 'block_hash': row['block_hash'], 'commitment': row['commitment'], 'created_at': row['created_at'], 'balances': decode_snapshot(row['data'])}
+
+    def _fetch_snapshot_list(self, address: str) -> List[Dict]:
+        try:
+            response = requests.get(f'{address}/snapshots', timeout=Config.SYNC_TIMEOUT_SECONDS)
+            return response.json()['snapshots'] if response.status_code == 200 else []
+        except (requests.exceptions.RequestException, KeyError, ValueError): return []
+
+    def _fetch_snapshot(self, addresses: List[str], height: int, block_hash: str, commitment: str) -> Optional[List[Tuple[str, float]]]:
+        for address in addresses:
             try:
-                cursor = self.conn.cursor()
-                cursor.execute("DELETE FROM blocks"); cursor.execute("DELETE FROM balances")
-                self.conn.commit() # Commit các lệnh xóa
-                
-                # Tải lại transactions từ chuỗi JSON
-                for block_data in new_chain_data:
-                    if isinstance(block_data['transactions'], str):
-                       block_data['transactions'] = json.loads(block_data['transactions'])
-                    self._add_block_to_db(Block.from_dict(block_data))
-                
-                logging.info("✅ Đã thay thế chuỗi thành công!")
-                return True
-            except Exception as e:
-                self.conn.rollback()
-                logging.error(f"Lỗi khi thay thế chuỗi, đã hoàn tác: {e}")
-                return False
-        return False
+                response = requests.get(f'{address}/snapshots/{height}', timeout=Config.SYNC_TIMEOUT_SECONDS * 4)
+                if response.status_code != 200: continue
+                balances = [(str(a), float(b)) for a, b in response.json()['balances']]
+            except (requests.exceptions.RequestException, KeyError, TypeError, ValueError): continue
+            if compute_snapshot_commitment(height, block_hash, balances) == commitment: return canonical_balances(balances)
+            logging.warning(f"[Snapshot] Ảnh chụp từ {address} không khớp cam kết, bỏ qua.")
+        return None
+
+    def _verify_header_chain(self, addresses: List[str], height: int, block_hash: str) -> Optional[Tuple[Dict, Dict[int, int]]]:
+        """
+        Tải và xác thực header 0..height (liên kết, mã băm, PoW) mà không tải thân khối.
+        Trả về (header khối `height`, số khối theo từng độ khó trước khối đó).
+        """
+        previous_hash, last_header = Config.GENESIS_PREVIOUS_HASH, None
+        schedule = self._new_schedule()
+        difficulty_counts: Dict[int, int] = {}
+        for index, header in enumerate(self._stream_blocks(addresses, 0, height, headers_only=True)):
+            try: block = Block(header['index'], header['previous_hash'], header['timestamp'], [], header['nonce'], header['merkle_root'], header['difficulty'])
+            except (KeyError, TypeError, ValueError): return None
+            if header['index'] != index or header['previous_hash'] != previous_hash or header.get('hash') != block.hash: return None
+            if not schedule.accepts_timestamp(header['timestamp']): return None
+            difficulty = schedule.expected(index)
+            if header.get('difficulty') != difficulty or (schedule.requires_proof_of_work(index) and not block.hash.startswith("0" * difficulty)): return None
+            schedule.push(index, header['timestamp'], difficulty)
+            if index < height: difficulty_counts[difficulty] = difficulty_counts.get(difficulty, 0) + 1
+            previous_hash, last_header = block.hash, header
+        return (last_header, difficulty_counts) if previous_hash == block_hash else None
+
+    def bootstrap_from_snapshot(self, trusted_commitment: Optional[str] = None) -> bool:
+        """
+        Khởi động node mới từ ảnh chụp số dư thay vì phát lại toàn bộ chuỗi:
+          1. Chọn ảnh chụp cao nhất mà ít nhất Config.SNAPSHOT_MIN_AGREEING_PEERS peer
+             cùng công bố (hoặc khớp `trusted_commitment` nếu được cung cấp).
+          2. Tải số dư và kiểm tra lại cam kết băm.
+          3. Xác thực chuỗi header từ Sáng thế tới khối của ảnh chụp (PoW + liên kết).
+          4. Ghi header khối đó làm khối gốc cùng bảng số dư trong một giao dịch.
+        Sau đó gọi resolve_conflicts() để tải các khối phía sau ảnh chụp.
+        Chỉ dùng được khi chuỗi cục bộ mới chỉ có khối Sáng thế.
+        """
+        if self.tip.index != 0:
+            logging.warning("[Snapshot] Chuỗi cục bộ đã có dữ liệu, không khởi động từ ảnh chụp.")
+            return False
+        with self.peer_lock: peer_addresses = [peer_data['address'] for peer_data in self.peers.values()]
+        if not peer_addresses: return False
+        with ThreadPoolExecutor(max_workers=min(len(peer_addresses), Config.SYNC_MAX_PARALLEL)) as executor:
+            listings = list(executor.map(self._fetch_snapshot_list, peer_addresses))
+        votes: Dict[Tuple[int, str, str], List[str]] = {}
+        for address, snapshots in zip(peer_addresses, listings):
+            for snap in snapshots:
+                try: key = (int(snap['height']), str(snap['block_hash']), str(snap['commitment']))
+                except (KeyError, TypeError, ValueError): continue
+                votes.setdefault(key, []).append(address)
+        required = 1 if trusted_commitment else min(Config.SNAPSHOT_MIN_AGREEING_PEERS, len(peer_addresses))
+        candidates = [(key, addresses) for key, addresses in votes.items() if len(addresses) >= required and (trusted_commitment is None or key[2] == trusted_commitment)]
+        if not candidates:
+            logging.warning("[Snapshot] Không có ảnh chụp nào đủ số peer xác nhận.")
+            return False
+        (height, block_hash, commitment), addresses = max(candidates, key=lambda candidate: candidate[0][0])
+        balances = self._fetch_snapshot(addresses, height, block_hash, commitment)
+        if balances is None: return False
+        try: verified = self._verify_header_chain(addresses, height, block_hash)
+        except ValueError as e:
+            logging.warning(f"[Snapshot] {e}")
+            return False
+        if verified is None:
+            logging.warning(f"[Snapshot] Chuỗi header tới khối #{height} không hợp lệ.")
+            return False
+        base_header, difficulty_counts = verified
+        with self.mining_lock:
+            with self.storage.write() as cursor:
+                for table in ('blocks', 'balances', 'balance_deltas', 'tx', 'address_tx', 'snapshots'):
+                    cursor.execute(f"DELETE FROM {table}")
+                cursor.execute('INSERT INTO blocks ("index", hash, previous_hash, timestamp, nonce, merkle_root, body, difficulty) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (height, block_hash, base_header['previous_hash'], base_header['timestamp'], base_header['nonce'], base_header['merkle_root'], PRUNED_BODY, base_header['difficulty']))
+                cursor.executemany("INSERT INTO balances (address, balance) VALUES (?, ?)", balances)
+                cursor.execute("INSERT INTO snapshots (height, block_hash, commitment, created_at, data) VALUES (?, ?, ?, ?, ?)", (height, block_hash, commitment, time.time(), encode_snapshot(balances)))
+                cursor.execute("DELETE FROM chain_meta WHERE key LIKE 'base_blocks_difficulty_%'")
+                cursor.executemany("INSERT INTO chain_meta (key, value) VALUES (?, ?)", [(f"base_blocks_difficulty_{difficulty}", count) for difficulty, count in difficulty_counts.items()])
+            self.base_height = height
+            self._base_work = self._base_work_from_meta({f"base_blocks_difficulty_{difficulty}": count for difficulty, count in difficulty_counts.items()})
+            self._set_tip(ChainTip(height, block_hash, base_header['timestamp'], self._base_work + block_work(base_header['difficulty'])))
+            self.spendable_balances.clear()
+        logging.info(f"✅ Đã khởi động từ ảnh chụp tại khối #{height} ({len(balances)} địa chỉ, {len(addresses)} peer xác nhận).")
+        return True
 
     def calculate_actual_total_supply(self) -> float:
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT SUM(balance) FROM balances")
-            result = cursor.fetchone()
+            with self.storage.read() as conn:
+                result = conn.execute("SELECT SUM(balance) FROM balances").fetchone()
             return float(result[0]) if result and result[0] is not None else 0.0
         except Exception as e:
             logging.error(f"LỖI DB khi tính tổng cung: {e}")
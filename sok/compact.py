@@ -0,0 +1,61 @@
+# sok/compact.py
+# -*- coding: utf-8 -*-
+
+from typing import Any, Dict, Iterable, List, Optional
+from .block import Block
+from .transaction import TxRecord
+
+# Khối gọn (compact block): header + mã rút gọn của từng giao dịch thay vì giao dịch đầy đủ.
+# Giao dịch hệ thống (phần thưởng đào) không bao giờ có trong mempool nên được gửi kèm đầy đủ.
+SHORT_ID_LENGTH = 16  # Số ký tự hex đầu của mã giao dịch (64 bit)
+
+def short_tx_id(tx_id: str) -> str:
+    return tx_id[:SHORT_ID_LENGTH]
+
+def make_compact_block(block: Block) -> Dict[str, Any]:
+    short_ids: List[Optional[str]] = []
+    prefilled: List[List[Any]] = []
+    for position, record in enumerate(block.tx_records()):
+        if record.is_system:
+            short_ids.append(None)
+            prefilled.append([position, record.data])
+        else:
+            short_ids.append(short_tx_id(record.id))
+    return {**block.header_dict(), 'short_ids': short_ids, 'prefilled': prefilled}
+
+def index_short_ids(records: Iterable[TxRecord]) -> Dict[str, Optional[TxRecord]]:
+    """Bảng mã rút gọn -> TxRecord của mempool; mã bị trùng được đánh dấu None (coi như thiếu)."""
+    index: Dict[str, Optional[TxRecord]] = {}
+    for record in records:
+        short_id = short_tx_id(record.id)
+        index[short_id] = None if short_id in index else record
+    return index
+
+class PartialBlock:
+    """
+    Khối đang được dựng lại từ một khối gọn: các vị trí tìm được trong mempool được điền
+    ngay, các vị trí còn thiếu (`missing`) chờ peer gửi qua fill().
+    """
+    def __init__(self, compact: Dict[str, Any], mempool_index: Dict[str, Optional[TxRecord]]):
+        short_ids = compact['short_ids']
+        if not isinstance(short_ids, list): raise ValueError("short_ids không hợp lệ.")
+        self.header = {key: compact[key] for key in ('index', 'hash', 'previous_hash', 'timestamp', 'nonce', 'merkle_root', 'difficulty')}
+        self.transactions: List[Optional[Dict]] = [None] * len(short_ids)
+        for position, tx in compact.get('prefilled') or []:
+            self.transactions[position] = tx
+        for position, short_id in enumerate(short_ids):
+            if self.transactions[position] is None and short_id is not None:
+                record = mempool_index.get(short_id)
+                if record is not None: self.transactions[position] = record.data
+        self.missing: List[int] = [position for position, tx in enumerate(self.transactions) if tx is None]
+
+    def fill(self, transactions: List[Dict]) -> bool:
+        """Điền các giao dịch còn thiếu theo đúng thứ tự của `missing`."""
+        if not isinstance(transactions, list) or len(transactions) != len(self.missing): return False
+        for position, tx in zip(self.missing, transactions):
+            self.transactions[position] = tx
+        self.missing = []
+        return True
+
+    def to_block_dict(self) -> Dict[str, Any]:
+        return {**self.header, 'transactions': self.transactions}
@@ -0,0 +1,133 @@
+# sok/mempool.py
+# -*- coding: utf-8 -*-
+
+import hashlib
+import math
+import threading
+import logging
+from collections import OrderedDict
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from .transaction import TxRecord, canonical_transaction_bytes
+
+def transaction_id(tx: Dict) -> str:
+    """Mã định danh giao dịch: SHA256 của nội dung, không gồm chữ ký và địa chỉ người gửi."""
+    return hashlib.sha256(canonical_transaction_bytes(tx)).hexdigest()
+
+class Mempool:
+    """
+    Vùng chờ giao dịch có chỉ mục và giới hạn kích thước.
+
+    Mỗi giao dịch được lưu một lần dưới dạng TxRecord theo mã định danh (thứ tự đến
+    được giữ nguyên), kèm chỉ mục theo người gửi. Thêm, tra cứu và xóa theo id đều là O(1).
+
+    Mempool cũng theo dõi tổng số tiền đang chờ chi của từng người gửi (`pending_debit`),
+    dùng cho SpendableBalances khi nhận giao dịch mới.
+
+    Thứ tự loại bỏ khi đầy:
+      1. Giao dịch mới bị từ chối nếu người gửi đã có `max_per_sender` giao dịch chờ.
+      2. Giao dịch mới bị từ chối nếu riêng nó đã lớn hơn `max_bytes`.
+      3. Nếu sau khi thêm mà vượt `max_count` hoặc `max_bytes`, các giao dịch
+         đến sớm nhất bị loại trước (FIFO) cho tới khi về lại giới hạn.
+    `on_evict(tx_id, tx)` được gọi (ngoài khóa) cho mỗi giao dịch bị loại ở bước 3.
+    """
+    def __init__(self, max_count: int, max_bytes: int, max_per_sender: int, on_evict: Optional[Callable[[str, Dict], None]] = None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_per_sender = max_per_sender
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, TxRecord]" = OrderedDict()
+        self._by_sender: Dict[str, Dict[str, None]] = {}
+        self._debits: Dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._entries
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def pending_debit(self, sender_address: str) -> float:
+        return self._debits.get(sender_address, 0.0)
+
+    def add(self, tx: Union[Dict, TxRecord], tx_id: Optional[str] = None, available: Optional[float] = None) -> bool:
+        """
+        Thêm giao dịch. Nếu có `available` (số dư đã xác nhận của người gửi), giao dịch bị
+        từ chối khi cộng với các khoản đang chờ chi sẽ vượt quá số dư đó; phép kiểm tra và
+        việc thêm diễn ra trong cùng một khóa nên hai giao dịch đồng thời không thể cùng lọt.
+        """
+        record = tx if isinstance(tx, TxRecord) else TxRecord(tx, tx_id)
+        tx_id = record.id
+        with self._lock:
+            if tx_id in self._entries: return False
+            if len(self._by_sender.get(record.sender, ())) >= self.max_per_sender: return False
+            if record.size > self.max_bytes: return False
+            # Số tiền không dương (hoặc NaN/vô cực) sẽ làm hỏng tổng chờ chi của người gửi.
+            if record.amount is None or not math.isfinite(record.amount) or not record.amount > 0: return False
+            if available is not None and self._debits.get(record.sender, 0.0) + record.amount > available: return False
+            self._entries[tx_id] = record
+            self._by_sender.setdefault(record.sender, {})[tx_id] = None
+            self._bytes += record.size
+            if record.amount: self._debits[record.sender] = self._debits.get(record.sender, 0.0) + record.amount
+            evicted = []
+            while len(self._entries) > self.max_count or self._bytes > self.max_bytes:
+                oldest_id = next(iter(self._entries))
+                evicted.append((oldest_id, self._remove_locked(oldest_id).data))
+        if evicted:
+            logging.warning(f"[Mempool] Đã đầy, loại bỏ {len(evicted)} giao dịch cũ nhất.")
+            if self.on_evict is not None:
+                for evicted_id, evicted_tx in evicted: self.on_evict(evicted_id, evicted_tx)
+        return tx_id in self._entries
+
+    def _remove_locked(self, tx_id: str) -> Optional[TxRecord]:
+        record = self._entries.pop(tx_id, None)
+        if record is None: return None
+        self._bytes -= record.size
+        if record.amount: self._debits[record.sender] = self._debits.get(record.sender, 0.0) - record.amount
+        sender_ids = self._by_sender.get(record.sender)
+        if sender_ids is not None:
+            sender_ids.pop(tx_id, None)
+            if not sender_ids:
+                del self._by_sender[record.sender]
+                self._debits.pop(record.sender, None)
+        return record
+
+    def remove(self, tx_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._remove_locked(tx_id)
+        return record.data if record else None
+
+    def remove_many(self, tx_ids: Iterable[str]) -> int:
+        with self._lock:
+            return sum(1 for tx_id in tx_ids if self._remove_locked(tx_id) is not None)
+
+    def get(self, tx_id: str) -> Optional[Dict]:
+        record = self._entries.get(tx_id)
+        return record.data if record else None
+
+    def records(self) -> List[TxRecord]:
+        """Danh sách TxRecord theo thứ tự đến."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def items(self) -> List[Tuple[str, Dict]]:
+        """Danh sách (id, giao dịch) theo thứ tự đến."""
+        with self._lock:
+            return [(tx_id, record.data) for tx_id, record in self._entries.items()]
+
+    def transactions(self) -> List[Dict]:
+        with self._lock:
+            return [record.data for record in self._entries.values()]
+
+    def page(self, offset: int, limit: int) -> List[Dict]:
+        with self._lock:
+            return [record.data for record in islice(self._entries.values(), offset, offset + limit)]
+
+    def by_sender(self, sender_address: str) -> List[Dict]:
+        with self._lock:
+            return [self._entries[tx_id].data for tx_id in self._by_sender.get(sender_address, ())]
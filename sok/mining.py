@@ -0,0 +1,197 @@
+# sok/mining.py
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Optional, Tuple
+from .utils import Config
+
+# Số lần băm giữa hai lần kiểm tra tín hiệu dừng trong mỗi tiến trình con.
+CHECK_INTERVAL = 4096
+
+# Nonce là trường cuối cùng của header khối, mã hóa 8 byte big-endian.
+NONCE_STRUCT = struct.Struct('>Q')
+
+_stop_event = None
+
+def _init_worker(stop_event):
+    """Chạy một lần khi tiến trình con khởi động: giữ lại tín hiệu dừng dùng chung."""
+    global _stop_event
+    _stop_event = stop_event
+
+def _search_nonces(prefix: bytes, target: bytes, start: int, step: int, stop_event=None) -> Tuple[Optional[int], Optional[str], int]:
+    """
+    Duyệt các nonce start, start + step, start + 2*step, ... cho tới khi
+    sha256(prefix + nonce) nhỏ hơn `target` hoặc nhận tín hiệu dừng.
+    Trả về (nonce, hash, số lần băm đã thử); nonce là None nếu bị dừng.
+    """
+    stop_event = stop_event or _stop_event
+    base = hashlib.sha256(prefix)
+    pack = NONCE_STRUCT.pack
+    nonce, tried = start, 0
+    while True:
+        for _ in range(CHECK_INTERVAL):
+            h = base.copy()
+            h.update(pack(nonce))
+            digest = h.digest()
+            if digest < target:
+                if stop_event is not None: stop_event.set()
+                return nonce, digest.hex(), tried + 1
+            nonce += step
+            tried += 1
+        if stop_event is not None and stop_event.is_set():
+            return None, None, tried
+
+def difficulty_target(difficulty: int) -> bytes:
+    """Ngưỡng 32 byte: mã băm nhỏ hơn ngưỡng này ⇔ có `difficulty` chữ số hex 0 ở đầu."""
+    return (16 ** (64 - difficulty)).to_bytes(33, 'big')[1:] if difficulty > 0 else b'\xff' * 33
+
+def retarget_difficulty(parent_difficulty: int, window_seconds: float) -> int:
+    """
+    Độ khó mới tại mỗi mốc Config.DIFFICULTY_ADJUSTMENT_INTERVAL khối, chỉ tính từ dấu thời
+    gian nên mọi node cho cùng kết quả. Mỗi bậc độ khó (thêm một chữ số hex 0) tốn gấp 16
+    lần công việc, nên độ khó chỉ đổi một bậc khi thời gian thực tế của cửa sổ lệch mục
+    tiêu quá DIFFICULTY_ADJUSTMENT_FACTOR lần (4 là trung điểm nhân của 16).
+    """
+    expected = (Config.DIFFICULTY_ADJUSTMENT_INTERVAL - 1) * Config.TARGET_BLOCK_TIME_SECONDS
+    difficulty = parent_difficulty
+    if window_seconds * Config.DIFFICULTY_ADJUSTMENT_FACTOR <= expected: difficulty += 1
+    elif window_seconds >= expected * Config.DIFFICULTY_ADJUSTMENT_FACTOR: difficulty -= 1
+    return max(Config.MIN_DIFFICULTY, min(Config.MAX_DIFFICULTY, difficulty))
+
+def block_work(difficulty: int) -> int:
+    """Số lần băm kỳ vọng để đạt `difficulty` chữ số hex 0; công việc tích lũy của chuỗi là tổng giá trị này."""
+    return 16 ** difficulty
+
+class DifficultySchedule:
+    """
+    Độ khó và giới hạn dấu thời gian bắt buộc của từng khối khi duyệt chuỗi theo thứ tự.
+    Chỉ giữ cửa sổ DIFFICULTY_ADJUSTMENT_INTERVAL khối gần nhất (index, timestamp, difficulty)
+    và dấu thời gian của MEDIAN_TIME_SPAN khối gần nhất.
+    Khối ở mốc điều chỉnh i dùng khoảng thời gian từ khối i - INTERVAL tới khối i - 1;
+    các khối khác giữ nguyên độ khó của khối cha. Các khối trước `retarget_height`
+    (lịch sử có độ khó cố định) luôn dùng độ khó ban đầu và các khối trước `pow_height`
+    (lịch sử JSON cũ có mã băm được tính lại) không được kiểm tra PoW. Mặc định lấy từ
+    Config.DIFFICULTY_RETARGET_HEIGHT và Config.HEADER_HASH_ACTIVATION_HEIGHT.
+    """
+    def __init__(self, initial_difficulty: int, retarget_height: Optional[int] = None, pow_height: Optional[int] = None):
+        self.initial_difficulty = initial_difficulty
+        self.retarget_height = Config.DIFFICULTY_RETARGET_HEIGHT if retarget_height is None else retarget_height
+        self.pow_height = Config.HEADER_HASH_ACTIVATION_HEIGHT if pow_height is None else pow_height
+        self._window: Deque[Tuple[int, float, int]] = deque(maxlen=Config.DIFFICULTY_ADJUSTMENT_INTERVAL)
+        self._timestamps: Deque[float] = deque(maxlen=Config.MEDIAN_TIME_SPAN)
+
+    def push(self, index: int, timestamp: float, difficulty: int):
+        self._window.append((index, timestamp, difficulty))
+        self._timestamps.append(timestamp)
+
+    def median_time_past(self) -> Optional[float]:
+        """Trung vị dấu thời gian của các khối gần nhất (None nếu chưa có khối nào)."""
+        if not self._timestamps: return None
+        return sorted(self._timestamps)[len(self._timestamps) // 2]
+
+    def accepts_timestamp(self, timestamp: float, now: Optional[float] = None) -> bool:
+        """Dấu thời gian phải lớn hơn trung vị các khối trước và không vượt quá giờ hiện tại + MAX_FUTURE_BLOCK_TIME_SECONDS."""
+        if not isinstance(timestamp, (int, float)): return False
+        median = self.median_time_past()
+        if median is not None and timestamp <= median: return False
+        return timestamp <= (now if now is not None else time.time()) + Config.MAX_FUTURE_BLOCK_TIME_SECONDS
+
+    def requires_proof_of_work(self, index: int) -> bool:
+        """Khối Sáng thế và lịch sử chuyển từ định dạng JSON cũ (trước pow_height) không mang PoW trên header."""
+        return index > 0 and index >= self.pow_height
+
+    def expected(self, index: int) -> int:
+        if index == 0 or index < self.retarget_height or not self._window: return self.initial_difficulty
+        _, parent_timestamp, parent_difficulty = self._window[-1]
+        interval = Config.DIFFICULTY_ADJUSTMENT_INTERVAL
+        if index % interval: return parent_difficulty
+        start = next((entry for entry in self._window if entry[0] == index - interval), None)
+        # Thiếu lịch sử (chỉ xảy ra nếu khối gốc ảnh chụp không nằm ở mốc điều chỉnh): giữ nguyên.
+        if start is None: return parent_difficulty
+        return retarget_difficulty(parent_difficulty, parent_timestamp - start[1])
+
+class MiningResult:
+    def __init__(self, nonce: Optional[int], hash: Optional[str], hashes: int, elapsed: float, workers: int):
+        self.nonce = nonce
+        self.hash = hash
+        self.hashes = hashes
+        self.elapsed = elapsed
+        self.workers = workers
+
+    @property
+    def found(self) -> bool:
+        return self.nonce is not None
+
+    @property
+    def hashrate(self) -> float:
+        return self.hashes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {'nonce': self.nonce, 'hash': self.hash, 'hashes': self.hashes, 'elapsed': round(self.elapsed, 3), 'hashrate': round(self.hashrate, 1), 'workers': self.workers}
+
+class MiningEngine:
+    """
+    Bộ máy Proof-of-Work đa lõi.
+    Không gian nonce được chia xen kẽ cho `workers` tiến trình (tiến trình i thử
+    start + i, start + i + workers, ...). Tiến trình đầu tiên tìm được lời giải
+    bật tín hiệu dừng dùng chung để mọi tiến trình khác dừng lại ngay.
+    Với workers = 1, việc khai thác chạy ngay trong tiến trình hiện tại.
+    `abort()` dùng chính tín hiệu đó để hủy lượt khai thác đang chạy từ luồng khác
+    (ví dụ khi đỉnh chuỗi thay đổi); `mine()` khi đó trả về kết quả không có nonce.
+    """
+    def __init__(self, workers: Optional[int] = None):
+        self.workers: int = max(1, workers or os.cpu_count() or 1)
+        self.last_result: Optional[MiningResult] = None
+        self._ctx = multiprocessing.get_context()
+        self._stop_event = self._ctx.Event() if self.workers > 1 else threading.Event()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._ctx, initializer=_init_worker, initargs=(self._stop_event,))
+        return self._pool
+
+    def mine(self, prefix: bytes, difficulty: int, start_nonce: int = 0) -> MiningResult:
+        """Tìm nonce sao cho sha256(prefix + nonce) có `difficulty` chữ số hex 0 ở đầu."""
+        target = difficulty_target(difficulty)
+        with self._lock:
+            started = time.time()
+            if self.workers == 1:
+                nonce, digest, hashes = _search_nonces(prefix, target, start_nonce, 1, self._stop_event)
+            else:
+                pool = self._get_pool()
+                futures = [pool.submit(_search_nonces, prefix, target, start_nonce + i, self.workers) for i in range(self.workers)]
+                nonce, digest, hashes = None, None, 0
+                for future in futures:
+                    found_nonce, found_hash, tried = future.result()
+                    hashes += tried
+                    if found_nonce is not None and (nonce is None or found_nonce < nonce):
+                        nonce, digest = found_nonce, found_hash
+            self._stop_event.clear()
+            result = MiningResult(nonce, digest, hashes, time.time() - started, self.workers)
+        self.last_result = result
+        logging.info(f"[Mining] Đã thử {result.hashes} mã băm trong {result.elapsed:.2f}s ({result.hashrate:,.0f} H/s, {self.workers} tiến trình).")
+        return result
+
+    def abort(self):
+        """Yêu cầu lượt khai thác hiện tại dừng lại (các tiến trình dừng sau tối đa CHECK_INTERVAL lần băm)."""
+        self._stop_event.set()
+
+    def reset(self):
+        """Xóa yêu cầu hủy còn sót lại trước khi bắt đầu khai thác một khối mẫu mới."""
+        self._stop_event.clear()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._stop_event.set()
+            self._pool.shutdown(wait=True)
+            self._pool = None
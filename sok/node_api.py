@@ -3,13 +3,17 @@
 
 import os
 import json
+import zlib
+import hashlib
 import threading
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import logging
-from .transaction import Transaction
-from .wallet import Wallet
+from .transaction import Transaction, TxRecord
+from .wallet import LRUCache, Wallet, key_cache_stats
 from .blockchain import Block
+from .p2p import COMPACT_STATUS_CODES, NODE_ID_HEADER
+from .utils import Config
 
 logger = logging.getLogger(__name__)
 
@@ -28,9 +32,83 @@ def update_local_map_file(nodes_list: list):
     except Exception as e:
         logger.error(f"[API] Lỗi khi ghi tệp bản đồ mạng cục bộ: {e}")
 
+# --- TRUYỀN CHUỖI DẠNG LUỒNG ---
+
+def stream_chain_json(blocks, length: int, batch_size: int):
+    """Sinh {"length": ..., "chain": [...]} theo từng đoạn (mỗi đoạn gồm tối đa batch_size khối)."""
+    yield f'{{"length":{length},"chain":['
+    buffer, first = [], True
+    for block_data in blocks:
+        buffer.append(json.dumps(block_data, separators=(',', ':')))
+        if len(buffer) >= batch_size:
+            yield ('' if first else ',') + ','.join(buffer)
+            buffer, first = [], False
+    if buffer: yield ('' if first else ',') + ','.join(buffer)
+    yield ']}'
+
+def stream_chain_ndjson(blocks, batch_size: int):
+    """Sinh mỗi khối một dòng JSON (NDJSON)."""
+    buffer = []
+    for block_data in blocks:
+        buffer.append(json.dumps(block_data, separators=(',', ':')) + '\n')
+        if len(buffer) >= batch_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer: yield ''.join(buffer)
+
+def gzip_stream(chunks):
+    """Nén gzip từng đoạn của một luồng văn bản."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data: yield data
+    yield compressor.flush()
+
+# --- BỘ ĐỆM PHẢN HỒI THEO ĐỈNH CHUỖI ---
+
+class TipResponseCache:
+    """
+    Bộ đệm cho các endpoint đọc mà dữ liệu chỉ đổi khi có khối mới được commit (số dư,
+    thống kê chuỗi, đoạn chuỗi). Khóa gồm mã băm đỉnh chuỗi hiện tại; khi đỉnh đổi toàn bộ
+    bộ đệm bị bỏ, nên không cần móc vào đường ghi khối.
+    """
+    def __init__(self, maxsize: int):
+        self._entries = LRUCache(maxsize)
+        self._tip_hash = None
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, tip_hash: str, key, compute):
+        with self._lock:
+            if tip_hash != self._tip_hash:
+                self._entries.clear()
+                self._tip_hash = tip_hash
+        return self._entries.get_or_compute((tip_hash, key), lambda _: compute())
+
+    def stats(self):
+        return self._entries.stats()
+
+def with_etag(body: bytes):
+    """Gắn ETag (băm của thân) để trả lời If-None-Match bằng 304."""
+    return body, hashlib.sha1(body).hexdigest()
+
 def create_app(blockchain, p2p_manager, node_wallet: Wallet, genesis_wallet: Wallet = None):
     app = Flask(__name__)
     CORS(app)
+    response_cache = TipResponseCache(Config.RESPONSE_CACHE_SIZE)
+    # Đoạn chuỗi có thể lớn nên dùng bộ đệm riêng, ít mục hơn.
+    chain_cache = TipResponseCache(Config.RESPONSE_CACHE_CHAIN_RANGES)
+
+    def cached_response(cache: TipResponseCache, tip_hash: str, key, compute, mimetype: str = 'application/json', headers=None):
+        """Phản hồi từ bộ đệm kèm ETag; If-None-Match khớp thì trả 304 không thân."""
+        body, etag = cache.get_or_compute(tip_hash, key, lambda: with_etag(compute()))
+        response = Response(body, mimetype=mimetype, headers=headers)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    @app.before_request
+    def refuse_if_chain_invalid():
+        # Chuỗi cục bộ không qua được xác thực lúc khởi động: không phục vụ dữ liệu có thể sai.
+        if blockchain.integrity_error: return jsonify({'error': 'Chuỗi cục bộ không hợp lệ, node tạm ngừng phục vụ.'}), 503
     
     # === API ĐỂ LAN TRUYỀN BẢN ĐỒ MẠNG ===
     @app.route('/nodes/update_map', methods=['POST'])
@@ -52,20 +130,26 @@ def create_app(blockchain, p2p_manager, node_wallet: Wallet, genesis_wallet: Wal
         
     @app.route('/handshake', methods=['GET'])
     def handshake():
-        return jsonify({"node_id": node_wallet.get_address()}), 200
+        # transport_port: cổng kênh TCP nhị phân giữa các node (None nếu không bật).
+        return jsonify({"node_id": node_wallet.get_address(), "transport_port": p2p_manager.transport_port}), 200
 
     @app.route('/nodes/peers', methods=['GET'])
     def get_peers():
         with blockchain.peer_lock:
             return jsonify(blockchain.peers), 200
 
+    @app.route('/nodes/propagation', methods=['GET'])
+    def get_propagation_stats():
+        return jsonify(p2p_manager.stats()), 200
+
     @app.route('/mine', methods=['GET'])
     def mine():
         miner_address = request.args.get('miner_address')
         if not miner_address: return jsonify({'error': 'Yêu cầu địa chỉ của thợ mỏ.'}), 400
         new_block = blockchain.mine_pending_transactions(miner_address)
         p2p_manager.broadcast_block(new_block)
-        return jsonify({'message': 'Đã khai thác khối mới!', 'block': new_block.to_dict()}), 200
+        mining_stats = blockchain.last_mining_result.to_dict() if blockchain.last_mining_result else None
+        return jsonify({'message': 'Đã khai thác khối mới!', 'block': new_block.to_dict(), 'mining': mining_stats}), 200
 
     @app.route('/transactions/new', methods=['POST'])
     def new_transaction():
@@ -74,15 +158,16 @@ def create_app(blockchain, p2p_manager, node_wallet: Wallet, genesis_wallet: Wal
             return jsonify({'error': 'Thiếu trường dữ liệu.'}), 400
         
         tx = Transaction.from_dict(values)
+        record = TxRecord(values)
         
         # SỬA LỖI: Xử lý đúng tuple (is_valid, message) trả về từ hàm is_valid
-        is_valid, message = tx.is_valid(blockchain)
+        is_valid, message = tx.is_valid(blockchain, record.id)
         if not is_valid: 
             logger.warning(f"Từ chối giao dịch không hợp lệ: {message}")
             return jsonify({'error': f'Giao dịch không hợp lệ: {message}'}), 400
 
-        if blockchain.add_transaction(values):
-            p2p_manager.broadcast_transaction(values)
+        if blockchain.add_transaction(record):
+            p2p_manager.broadcast_transaction(record)
             return jsonify({'message': 'Giao dịch sẽ được thêm vào khối tiếp theo.'}), 201
         
         return jsonify({'message': 'Giao dịch đã tồn tại hoặc đã được xử lý.'}), 400
@@ -92,57 +177,154 @@ def create_app(blockchain, p2p_manager, node_wallet: Wallet, genesis_wallet: Wal
         """
         API endpoint mới để trả về thông tin về các giao dịch đang chờ (mempool).
         Discovery Agent và Intelligent Miner sẽ gọi API này.
+        Hỗ trợ phân trang qua `offset` và `limit` (tối đa Config.MEMPOOL_PAGE_SIZE).
         """
-        pending_txs = blockchain.pending_transactions
+        try:
+            offset = max(0, int(request.args.get('offset', 0)))
+            limit = min(max(1, int(request.args.get('limit', Config.MEMPOOL_PAGE_SIZE))), Config.MEMPOOL_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'Tham số offset/limit phải là số nguyên.'}), 400
         response = {
-            'pending_transactions': pending_txs,
-            'count': len(pending_txs)
+            'pending_transactions': blockchain.mempool.page(offset, limit),
+            'count': len(blockchain.mempool),
+            'size_bytes': blockchain.mempool.size_bytes,
+            'offset': offset,
+            'limit': limit
         }
         return jsonify(response), 200
 
     @app.route('/chain', methods=['GET'])
     def get_chain():
-        # SỬA LỖI: Thêm logic để xử lý tham số `start`
-        start_index_str = request.args.get('start')
-        full_chain_data = blockchain.get_full_chain_for_api()
-
-        if start_index_str:
-            try:
-                start_index = int(start_index_str)
-                filtered_chain = [block for block in full_chain_data if block['index'] >= start_index]
-                return jsonify({'chain': filtered_chain, 'length': len(full_chain_data)}), 200
-            except ValueError:
-                return jsonify({'error': 'Tham số start phải là một số nguyên.'}), 400
-        
-        return jsonify({'chain': full_chain_data, 'length': len(full_chain_data)}), 200
+        # Phân trang trong SQL theo khoảng chỉ số và truyền dạng luồng: bộ nhớ phía node không
+        # phụ thuộc độ dài đoạn được yêu cầu. format=ndjson (hoặc Accept: application/x-ndjson)
+        # trả mỗi khối một dòng; mặc định là {"length", "chain"} như trước. Nén gzip khi client cho phép.
+        try:
+            start_index = max(0, int(request.args.get('start') or 0))
+            limit = max(0, int(request.args['limit'])) if request.args.get('limit') else None
+        except ValueError:
+            return jsonify({'error': 'Tham số start/limit phải là số nguyên.'}), 400
+        headers_only = request.args.get('headers') in ('1', 'true')
+        ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        tip = blockchain.tip
+        chain_length = tip.index + 1
+
+        def render():
+            blocks = blockchain.iter_block_range(start_index, limit, headers_only, Config.CHAIN_STREAM_BATCH_SIZE)
+            if ndjson: body = stream_chain_ndjson(blocks, Config.CHAIN_STREAM_BATCH_SIZE)
+            else: body = stream_chain_json(blocks, chain_length, Config.CHAIN_STREAM_BATCH_SIZE)
+            return gzip_stream(body) if use_gzip else (chunk.encode('utf-8') for chunk in body)
+
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        headers = {'X-Chain-Length': str(chain_length), 'Vary': 'Accept-Encoding'}
+        if use_gzip: headers['Content-Encoding'] = 'gzip'
+        # Đoạn có giới hạn (như khi peer đồng bộ) được đệm theo đỉnh chuỗi; đoạn không giới hạn luôn truyền dạng luồng.
+        if limit is not None and limit <= Config.RESPONSE_CACHE_MAX_BLOCKS:
+            key = ('chain', start_index, limit, headers_only, ndjson, use_gzip)
+            return cached_response(chain_cache, tip.hash, key, lambda: b''.join(render()), mimetype, headers)
+        return Response(render(), mimetype=mimetype, headers=headers)
+
+    @app.route('/chain/tip', methods=['GET'])
+    def get_chain_tip():
+        return jsonify(blockchain.tip._asdict()), 200
 
     @app.route('/balance/<address>', methods=['GET'])
     def get_balance(address):
         if not address: return jsonify({'error': 'Địa chỉ không được để trống.'}), 400
-        return jsonify({'address': address, 'balance': blockchain.get_balance(address)}), 200
+        compute = lambda: app.json.dumps({'address': address, 'balance': blockchain.get_balance(address)}).encode('utf-8')
+        return cached_response(response_cache, blockchain.tip.hash, ('balance', address), compute)
+
+    @app.route('/tx/<tx_id>', methods=['GET'])
+    def get_transaction(tx_id):
+        result = blockchain.get_transaction(tx_id)
+        if result: return jsonify({**result, 'status': 'confirmed'}), 200
+        pending_tx = blockchain.mempool.get(tx_id)
+        if pending_tx: return jsonify({'tx_id': tx_id, 'transaction': pending_tx, 'status': 'pending'}), 200
+        return jsonify({'error': 'Không tìm thấy giao dịch.'}), 404
+
+    @app.route('/address/<address>/transactions', methods=['GET'])
+    def get_address_transactions(address):
+        try:
+            limit = min(max(1, int(request.args.get('limit', 50))), Config.HISTORY_PAGE_SIZE)
+            cursor_str = request.args.get('cursor')
+            cursor = tuple(int(part) for part in cursor_str.split(':')) if cursor_str else None
+            if cursor is not None and len(cursor) != 2: raise ValueError
+        except ValueError:
+            return jsonify({'error': 'Tham số cursor/limit không hợp lệ.'}), 400
+        history, next_cursor = blockchain.get_address_transactions(address, cursor, limit)
+        return jsonify({
+            'address': address,
+            'transactions': history,
+            'next_cursor': f"{next_cursor[0]}:{next_cursor[1]}" if next_cursor else None
+        }), 200
+
+    @app.route('/snapshots', methods=['GET'])
+    def list_snapshots():
+        return jsonify({'snapshots': blockchain.list_snapshots()}), 200
+
+    @app.route('/snapshots/latest', methods=['GET'])
+    @app.route('/snapshots/<int:height>', methods=['GET'])
+    def get_snapshot(height=None):
+        snapshot = blockchain.get_snapshot(height)
+        if not snapshot: return jsonify({'error': 'Không tìm thấy ảnh chụp.'}), 404
+        return jsonify(snapshot), 200
 
     @app.route('/chain/stats', methods=['GET'])
     def get_chain_stats():
         try:
+            # Phần phụ thuộc đỉnh chuỗi (SUM số dư, độ khó) được đệm; phần còn lại đọc từ bộ nhớ.
+            tip = blockchain.tip
+            chain_state = response_cache.get_or_compute(tip.hash, 'chain_stats', lambda: {
+                "total_supply": blockchain.calculate_actual_total_supply(),
+                "block_height": tip.index,
+                "difficulty": blockchain.difficulty
+            })
             stats = {
-                "total_supply": blockchain.calculate_actual_total_supply(), 
-                "block_height": blockchain.last_block.index, 
-                "pending_tx_count": len(blockchain.pending_transactions), 
-                "difficulty": blockchain.difficulty,
-                "peer_count": len(blockchain.peers)
+                **chain_state,
+                "pending_tx_count": len(blockchain.mempool), 
+                "peer_count": len(blockchain.peers),
+                "key_cache": key_cache_stats()
             }
-            return jsonify(stats), 200
+            response = jsonify(stats)
+            # ETag theo toàn bộ thân: mempool/peer/bộ đệm khóa đổi giữa hai khối nên không thể chỉ dùng mã băm đỉnh.
+            response.set_etag(with_etag(response.get_data())[1])
+            return response.make_conditional(request)
         except Exception as e:
             logger.error(f"Lỗi khi lấy thống kê chuỗi: {e}")
             return jsonify({"error": "Không thể xử lý yêu cầu thống kê."}), 500
 
     # Các endpoint P2P để nhận dữ liệu từ các node khác
+    @app.route('/inventory/announce', methods=['POST'])
+    def announce_inventory():
+        # Peer chỉ gửi mã khối/giao dịch; trả lời những mã còn thiếu để peer gửi dữ liệu đầy đủ.
+        inventory = request.get_json(silent=True)
+        if not isinstance(inventory, dict):
+            return jsonify({'error': 'Dữ liệu không hợp lệ.'}), 400
+        return jsonify({'want': p2p_manager.handle_announce(request.headers.get(NODE_ID_HEADER), inventory)}), 200
+
+    @app.route('/blocks/compact', methods=['POST'])
+    def add_compact_block_from_peer():
+        # Khối gọn: header + mã rút gọn của giao dịch; khối được dựng lại từ mempool.
+        compact = request.get_json(silent=True)
+        if not isinstance(compact, dict):
+            return jsonify({'status': 'invalid'}), 400
+        result = p2p_manager.handle_compact_block(request.headers.get(NODE_ID_HEADER), compact)
+        return jsonify(result), COMPACT_STATUS_CODES.get(result['status'], 200)
+
+    @app.route('/blocks/compact/fill', methods=['POST'])
+    def fill_compact_block():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('hash'), str):
+            return jsonify({'status': 'invalid'}), 400
+        result = p2p_manager.handle_block_fill(request.headers.get(NODE_ID_HEADER), data['hash'], data.get('transactions'))
+        return jsonify(result), COMPACT_STATUS_CODES.get(result['status'], 200)
+
     @app.route('/blocks/add_from_peer', methods=['POST'])
     def add_block_from_peer_api():
         block_data = request.get_json()
         if not block_data:
             return "Dữ liệu không hợp lệ.", 400
-        if blockchain.add_block_from_peer(block_data):
+        if p2p_manager.ingest_block(block_data, request.headers.get(NODE_ID_HEADER)):
             return "Đã chấp nhận khối.", 200
         return "Xung đột hoặc khối không hợp lệ.", 409
 
@@ -151,8 +333,17 @@ def create_app(blockchain, p2p_manager, node_wallet: Wallet, genesis_wallet: Wal
         tx_data = request.get_json()
         if not tx_data:
             return "Dữ liệu không hợp lệ.", 400
-        if blockchain.add_transaction(tx_data):
-            return "Đã chấp nhận giao dịch.", 200
-        return "Giao dịch đã tồn tại.", 409
-            
+        status, _ = p2p_manager.ingest_transaction(tx_data, request.headers.get(NODE_ID_HEADER))
+        if status == 'accepted': return "Đã chấp nhận giao dịch.", 200
+        if status == 'rejected': return "Giao dịch đã tồn tại hoặc vượt quá số dư khả dụng.", 409
+        return "Giao dịch không hợp lệ.", 400
+
+    @app.route('/transactions/add_from_peer_batch', methods=['POST'])
+    def add_transactions_from_peer_batch():
+        # Kết quả trả về theo đúng thứ tự của danh sách gửi lên.
+        data = request.get_json(silent=True)
+        transactions = data.get('transactions') if isinstance(data, dict) else None
+        code, result = p2p_manager.ingest_transactions(transactions, request.headers.get(NODE_ID_HEADER))
+        return jsonify(result), code
+
     return app
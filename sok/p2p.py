@@ -1,28 +1,511 @@
-# Đảm bảo import đúng
-from sok.p2p import HybridP2PManager 
-
-# ...
-
-def main():
-    # ...
-    
-    # Khởi tạo P2P Manager
-    p2p_manager = HybridP2PManager(
-        blockchain=blockchain_instance, 
-        node_wallet=node_wallet, 
-        node_port=args.port,
-        project_root=project_root # Truyền đường dẫn gốc vào
-    )
-    
-    # Tạo app và truyền p2p_manager vào
-    app = create_app(
-        blockchain=blockchain_instance,
-        p2p_manager=p2p_manager,
-        node_wallet=node_wallet
-    )
-
-    # Khởi động P2P Manager
-    if 'p2p' in roles:
-        p2p_manager.start()
-
-    # ... (phần còn lại của hàm main)
+# sok/p2p.py
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from .block import Block, compute_merkle_root
+from .compact import PartialBlock, index_short_ids, make_compact_block
+from .transaction import Transaction, TxRecord
+from .transport import TransportClient, TransportError, TransportServer, TransportTimeout
+from .wallet import LRUCache
+from .utils import Config
+
+NODE_ID_HEADER = "X-Node-Id"
+
+# Mã HTTP cho kết quả nhận khối gọn; các trạng thái khác (accepted, known, missing, failed) trả về 200.
+COMPACT_STATUS_CODES = {'rejected': 409, 'invalid': 400}
+TRANSACTION_STATUS_CODES = {'accepted': 200, 'rejected': 409, 'invalid': 400}
+
+# Endpoint HTTP tương ứng với từng phương thức của kênh TCP (sok/transport.py).
+HTTP_PATHS = {
+    'announce': '/inventory/announce', 'compact_block': '/blocks/compact', 'block_fill': '/blocks/compact/fill',
+    'block': '/blocks/add_from_peer', 'transactions': '/transactions/add_from_peer_batch',
+    'transaction': '/transactions/add_from_peer', 'peers': '/nodes/peers',
+}
+
+class HttpChannel:
+    """Kênh HTTP tới một peer, cùng giao diện call() với TransportClient; dùng khi peer không có kênh TCP."""
+    def __init__(self, session: requests.Session, address: str):
+        self.session, self.address = session, address
+
+    def call(self, method: str, body: Any = None) -> Tuple[int, Any]:
+        url = f"{self.address}{HTTP_PATHS[method]}"
+        try:
+            if body is None: response = self.session.get(url, timeout=Config.P2P_TIMEOUT_SECONDS)
+            else: response = self.session.post(url, json=body, timeout=Config.P2P_TIMEOUT_SECONDS)
+        except requests.exceptions.ReadTimeout as e:
+            raise TransportTimeout(str(e))
+        except requests.RequestException as e:
+            raise TransportError(str(e))
+        try: data = response.json()
+        except ValueError: data = None
+        return response.status_code, data
+
+    def close(self):
+        pass
+
+class HybridP2PManager:
+    """
+    Quản lý kết nối P2P của một node.
+
+    - Khám phá peer: đọc live_network_nodes.json / bootstrap_config.json trong project_root,
+      bắt tay (/handshake) để lấy node_id rồi trao đổi danh sách peer (/nodes/peers).
+    - Đồng bộ định kỳ bằng Blockchain.resolve_conflicts().
+    - Lan truyền khối/giao dịch theo inventory: trước tiên chỉ thông báo mã (hash khối /
+      mã giao dịch) qua /inventory/announce; peer trả lời những mã nó còn thiếu và chỉ
+      khi đó dữ liệu đầy đủ mới được gửi. Mỗi peer có một tập "đã biết" (LRU) gồm các mã
+      nó đã thông báo cho ta hoặc ta đã thông báo/gửi cho nó, nên không gửi lại thứ peer
+      đã có. Peer không hỗ trợ inventory (404) được gửi thẳng dữ liệu đầy đủ.
+    - Khối được gửi dạng gọn (header + mã rút gọn của giao dịch, xem sok/compact.py):
+      peer dựng lại khối từ mempool của nó và chỉ xin những giao dịch còn thiếu. Nếu dựng
+      lại thất bại (gốc Merkle không khớp) hoặc peer chưa hỗ trợ, khối đầy đủ được gửi.
+    - Giao dịch được gom thành lô (theo thời gian hoặc số lượng) rồi thông báo/gửi một lần
+      cho mỗi peer qua /transactions/add_from_peer_batch.
+    - Tùy chọn kênh TCP nhị phân bền vững (sok/transport.py) khi có transport_port: peer
+      công bố cổng TCP qua /handshake và mọi thông điệp giữa hai node (thông báo, khối, giao
+      dịch, trao đổi peer) đi qua một kết nối dùng chung. Peer không có kênh TCP được gửi
+      qua HTTP; các endpoint HTTP vẫn giữ nguyên cho ví.
+    - Mỗi peer trong Blockchain.peers có một kênh riêng (kết nối TCP hoặc requests.Session
+      giữ kết nối HTTP keep-alive). Việc gửi được xếp hàng cho một nhóm luồng và chạy song song tới mọi
+      peer với thời gian chờ riêng cho từng peer, nên luồng xử lý API gọi broadcast_* trả
+      về ngay và một peer chậm không làm chậm các peer khác.
+    - Thời gian lan truyền tới từng peer được ghi lại (xem stats()).
+    """
+    def __init__(self, blockchain, node_wallet, node_port: int, project_root: str, transport_port: Optional[int] = None):
+        self.blockchain = blockchain
+        self.node_wallet = node_wallet
+        self.node_port = node_port
+        self.project_root = project_root
+        self.node_id: str = node_wallet.get_address()
+        if transport_port is None and Config.P2P_TRANSPORT_ENABLED: transport_port = node_port + Config.P2P_TRANSPORT_PORT_OFFSET
+        self.transport_port: Optional[int] = transport_port
+        self._transport_server: Optional[TransportServer] = None
+        self._sessions: Dict[str, requests.Session] = {}
+        self._sessions_lock = threading.Lock()
+        # Kênh tới từng peer (node_id -> (địa chỉ HTTP, kênh)) và cổng TCP mà peer đã công bố (None nếu không có).
+        self._channels: Dict[str, Tuple[str, Any]] = {}
+        self._peer_transport_ports: Dict[str, Optional[int]] = {}
+        self._channels_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=Config.P2P_MAX_PARALLEL, thread_name_prefix="p2p-send")
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Inventory: mã mà từng peer (theo node_id) đã có, và mã ta đã xin (mã -> thời điểm xin).
+        self._known: Dict[str, LRUCache] = {}
+        self._known_lock = threading.Lock()
+        self._requested = LRUCache(Config.P2P_KNOWN_INVENTORY_SIZE)
+        self._requested_lock = threading.Lock()
+        # Khối gọn đang chờ peer gửi các giao dịch còn thiếu (hash -> PartialBlock).
+        self._partial_blocks = LRUCache(Config.P2P_PARTIAL_BLOCKS)
+        # Lô giao dịch đang gom để lan truyền (mã -> TxRecord) và bộ hẹn giờ gửi lô.
+        self._tx_batch: Dict[str, TxRecord] = {}
+        self._tx_batch_lock = threading.Lock()
+        self._tx_batch_timer: Optional[threading.Timer] = None
+        # Thống kê theo địa chỉ peer: số lần gửi thành công/thất bại, số lần phải gửi dữ liệu đầy đủ,
+        # số lần bỏ qua vì peer đã có, thời gian lần gần nhất và trung bình trượt (ms).
+        self.peer_stats: Dict[str, Dict[str, Any]] = {}
+        self.last_broadcast: Optional[Dict[str, Any]] = None
+        self._stats_lock = threading.Lock()
+
+    # --- Vòng đời ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        if self.transport_port and self._transport_server is None:
+            self._transport_server = TransportServer("0.0.0.0", self.transport_port, self.dispatch)
+            self._transport_server.start()
+            self.transport_port = self._transport_server.port
+        self._thread = threading.Thread(target=self._maintenance_loop, name="p2p-maintenance", daemon=True)
+        self._thread.start()
+        logging.info(f"[P2P] Đã khởi động trình quản lý P2P (cổng {self.node_port}).")
+
+    def stop(self):
+        self._stop.set()
+        self.flush_transactions()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._transport_server is not None: self._transport_server.stop()
+        with self._channels_lock:
+            for _, channel in self._channels.values(): channel.close()
+            self._channels.clear()
+        with self._sessions_lock:
+            for session in self._sessions.values(): session.close()
+            self._sessions.clear()
+
+    def _maintenance_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.discover_peers()
+                self.exchange_peers()
+                self.blockchain.resolve_conflicts()
+            except Exception as e:
+                logging.error(f"[P2P] Lỗi trong vòng bảo trì mạng: {e}")
+            self._stop.wait(Config.P2P_SYNC_INTERVAL_SECONDS)
+
+    # --- Kết nối ---
+
+    def _session(self, address: str) -> requests.Session:
+        """Session dùng lại kết nối cho một peer (tạo khi cần)."""
+        with self._sessions_lock:
+            session = self._sessions.get(address)
+            if session is None:
+                session = requests.Session()
+                session.headers[NODE_ID_HEADER] = self.node_id
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=Config.P2P_POOL_SIZE))
+                self._sessions[address] = session
+            return session
+
+    def _handshake(self, address: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self._session(address).get(f"{address}/handshake", timeout=Config.P2P_TIMEOUT_SECONDS)
+            return response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError):
+            return None
+
+    def _channel(self, node_id: str, address: str):
+        """Kênh tới một peer: TCP nếu cả hai node đều bật kênh TCP, ngược lại là HTTP."""
+        with self._channels_lock:
+            entry = self._channels.get(node_id)
+            if entry is not None and entry[0] == address: return entry[1]
+            known_port = node_id in self._peer_transport_ports
+            port = self._peer_transport_ports.get(node_id)
+        if self.transport_port and not known_port:
+            info = self._handshake(address)
+            port = info.get('transport_port') if isinstance(info, dict) else None
+            if info is not None:
+                with self._channels_lock: self._peer_transport_ports[node_id] = port
+        if self.transport_port and isinstance(port, int): channel = TransportClient(urlparse(address).hostname, port, self.node_id)
+        else: channel = HttpChannel(self._session(address), address)
+        with self._channels_lock:
+            entry = self._channels.get(node_id)
+            if entry is not None and entry[0] == address:
+                channel.close()
+                return entry[1]
+            if entry is not None: entry[1].close()
+            self._channels[node_id] = (address, channel)
+        return channel
+
+    def _drop_channel(self, node_id: str):
+        """Bỏ kênh hỏng; lần gửi sau sẽ bắt tay lại (peer có thể đã khởi động lại không có kênh TCP)."""
+        with self._channels_lock:
+            entry = self._channels.pop(node_id, None)
+            self._peer_transport_ports.pop(node_id, None)
+        if entry is not None: entry[1].close()
+
+    def _peers(self) -> List[Tuple[str, str]]:
+        """Danh sách (node_id, địa chỉ) của các peer, trừ chính node này."""
+        with self.blockchain.peer_lock:
+            return [(node_id, peer_data['address']) for node_id, peer_data in self.blockchain.peers.items() if node_id != self.node_id]
+
+    def _load_known_nodes(self) -> List[str]:
+        nodes = set()
+        for file in ["live_network_nodes.json", "bootstrap_config.json"]:
+            config_path = os.path.join(self.project_root, file)
+            if not os.path.exists(config_path): continue
+            try:
+                with open(config_path, 'r', encoding='utf-8') as f: data = json.load(f)
+                if "active_nodes" in data: nodes.update(data["active_nodes"])
+                if "trusted_bootstrap_peers" in data: nodes.update([p.get('last_known_address') for p in data["trusted_bootstrap_peers"].values()])
+            except (OSError, ValueError, AttributeError) as e:
+                logging.warning(f"[P2P] Không đọc được {file}: {e}")
+        return [node.rstrip('/') for node in nodes if node]
+
+    def discover_peers(self):
+        """Bắt tay với các node đã biết từ tệp cấu hình nhưng chưa có trong danh sách peer."""
+        known = {address for _, address in self._peers()}
+        for address in self._load_known_nodes():
+            if address in known: continue
+            info = self._handshake(address)
+            node_id = info.get('node_id') if isinstance(info, dict) else None
+            if not node_id or node_id == self.node_id: continue
+            with self._channels_lock: self._peer_transport_ports[node_id] = info.get('transport_port')
+            self.blockchain.register_node(node_id, address)
+
+    def exchange_peers(self):
+        """Trao đổi danh sách peer (PEX) với mọi peer hiện có."""
+        for node_id, address in self._peers():
+            try:
+                status, peers = self._channel(node_id, address).call('peers')
+            except TransportTimeout:
+                continue
+            except TransportError:
+                self._drop_channel(node_id)
+                continue
+            if status == 200 and isinstance(peers, dict): self.blockchain.merge_peers(peers, self.node_id)
+
+    # --- Inventory ---
+
+    def _known_by(self, node_id: str) -> LRUCache:
+        with self._known_lock:
+            known = self._known.get(node_id)
+            if known is None: known = self._known[node_id] = LRUCache(Config.P2P_KNOWN_INVENTORY_SIZE)
+            return known
+
+    def mark_known(self, node_id: Optional[str], item_ids: Iterable[str]):
+        """Ghi nhận rằng peer `node_id` đã có các mã này."""
+        if not node_id: return
+        known = self._known_by(node_id)
+        for item_id in item_ids: known.put(item_id, True)
+
+    def _claim(self, item_id: str) -> bool:
+        """Giữ quyền xin một mã: chỉ peer thông báo đầu tiên được xin, trừ khi lần xin trước đã quá hạn."""
+        now = time.time()
+        with self._requested_lock:
+            requested_at = self._requested.get(item_id)
+            if requested_at is not None and now - requested_at < Config.P2P_REQUEST_TIMEOUT_SECONDS: return False
+            self._requested.put(item_id, now)
+            return True
+
+    def handle_announce(self, node_id: Optional[str], inventory: Dict[str, Any]) -> Dict[str, List[str]]:
+        """Xử lý thông báo inventory từ peer; trả về các mã còn thiếu cần peer gửi đầy đủ."""
+        want: Dict[str, List[str]] = {}
+        for kind, have in (('blocks', self.blockchain.has_block), ('transactions', self.blockchain.has_transaction)):
+            ids = inventory.get(kind)
+            ids = [item_id for item_id in ids[:Config.P2P_MAX_INVENTORY] if isinstance(item_id, str)] if isinstance(ids, list) else []
+            self.mark_known(node_id, ids)
+            want[kind] = [item_id for item_id in ids if not have(item_id) and self._claim(item_id)]
+        return want
+
+    # --- Nhận dữ liệu từ peer (dùng chung cho endpoint HTTP và kênh TCP) ---
+
+    def dispatch(self, method: str, body: Any, origin: Optional[str]) -> Tuple[int, Any]:
+        """Xử lý một yêu cầu từ kênh TCP; mã trạng thái giống endpoint HTTP tương ứng."""
+        if self.blockchain.integrity_error: return 503, None
+        if method == 'hello': return 200, {'node_id': self.node_id}
+        if method == 'peers':
+            with self.blockchain.peer_lock: return 200, dict(self.blockchain.peers)
+        if method == 'transaction':
+            status, _ = self.ingest_transaction(body, origin)
+            return TRANSACTION_STATUS_CODES[status], status
+        if not isinstance(body, dict): return 400, None
+        if method == 'transactions': return self.ingest_transactions(body.get('transactions'), origin)
+        if method == 'announce': return 200, {'want': self.handle_announce(origin, body)}
+        if method == 'block': return (200, 'accepted') if self.ingest_block(body, origin) else (409, 'rejected')
+        if method == 'compact_block': result = self.handle_compact_block(origin, body)
+        elif method == 'block_fill':
+            if not isinstance(body.get('hash'), str): return 400, {'status': 'invalid'}
+            result = self.handle_block_fill(origin, body['hash'], body.get('transactions'))
+        else: return 404, None
+        return COMPACT_STATUS_CODES.get(result['status'], 200), result
+
+    def ingest_block(self, block_data: Dict, origin: Optional[str]) -> bool:
+        if not self.blockchain.add_block_from_peer(block_data): return False
+        self.broadcast_block(block_data, origin)
+        return True
+
+    def ingest_transaction(self, tx_data: Any, origin: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Nhận một giao dịch từ peer; trả về (trạng thái, mã giao dịch hoặc None)."""
+        # Kiểm tra giống /transactions/new (địa chỉ khớp khóa công khai, chữ ký, số tiền > 0) ngay khi nhận;
+        # chữ ký hợp lệ được đệm nên khối chứa giao dịch này sau đó khỏi phải xác thực lại.
+        try: tx, record = Transaction.from_dict(tx_data), TxRecord(tx_data)
+        except (TypeError, ValueError, KeyError, AttributeError): return 'invalid', None
+        if record.is_system: return 'invalid', record.id
+        is_valid, message = tx.is_valid(self.blockchain, record.id)
+        if not is_valid:
+            logging.debug(f"[P2P] Từ chối giao dịch {record.id[:10]}... từ peer: {message}")
+            return 'invalid', record.id
+        if not self.blockchain.add_transaction(record): return 'rejected', record.id
+        self.broadcast_transaction(record, origin=origin)
+        return 'accepted', record.id
+
+    def ingest_transactions(self, transactions: Any, origin: Optional[str]) -> Tuple[int, Dict[str, Any]]:
+        """Nhận một lô giao dịch; kết quả trả về theo đúng thứ tự của danh sách gửi lên."""
+        if not isinstance(transactions, list): return 400, {'error': 'Dữ liệu không hợp lệ.'}
+        if len(transactions) > Config.P2P_TX_BATCH_MAX: return 413, {'error': f'Tối đa {Config.P2P_TX_BATCH_MAX} giao dịch mỗi lô.'}
+        results = []
+        for tx_data in transactions:
+            status, tx_id = self.ingest_transaction(tx_data, origin)
+            results.append({'tx_id': tx_id, 'status': status})
+        return 200, {'accepted': sum(result['status'] == 'accepted' for result in results), 'results': results}
+
+    def handle_compact_block(self, origin: Optional[str], compact: Dict[str, Any]) -> Dict[str, Any]:
+        """Dựng lại khối gọn từ mempool; trả về trạng thái và các vị trí giao dịch còn thiếu (nếu có)."""
+        block_hash = compact.get('hash')
+        if not isinstance(block_hash, str): return {'status': 'invalid'}
+        self.mark_known(origin, [block_hash])
+        if self.blockchain.has_block(block_hash): return {'status': 'known'}
+        try: partial = PartialBlock(compact, index_short_ids(self.blockchain.mempool.records()))
+        except (KeyError, TypeError, ValueError, IndexError): return {'status': 'invalid'}
+        if partial.missing:
+            self._partial_blocks.put(block_hash, partial)
+            return {'status': 'missing', 'missing': partial.missing}
+        return self._complete_block(origin, partial)
+
+    def handle_block_fill(self, origin: Optional[str], block_hash: str, transactions: List[Dict]) -> Dict[str, Any]:
+        """Nhận các giao dịch còn thiếu của một khối gọn đang chờ."""
+        partial = self._partial_blocks.get(block_hash)
+        self._partial_blocks.discard(block_hash)
+        if partial is None or not partial.fill(transactions): return {'status': 'failed'}
+        return self._complete_block(origin, partial)
+
+    def _complete_block(self, origin: Optional[str], partial: PartialBlock) -> Dict[str, Any]:
+        block_data = partial.to_block_dict()
+        if self.blockchain.add_block_from_peer(block_data):
+            self.broadcast_block(block_data, origin)
+            return {'status': 'accepted'}
+        # Gốc Merkle không khớp nghĩa là khối dựng lại sai (trùng mã rút gọn): xin khối đầy đủ.
+        try:
+            if compute_merkle_root(block_data['transactions']) != block_data['merkle_root']: return {'status': 'failed'}
+        except (TypeError, ValueError, AttributeError):
+            return {'status': 'failed'}
+        return {'status': 'rejected'}
+
+    # --- Lan truyền ---
+
+    def broadcast_block(self, block: Union[Block, Dict], origin: Optional[str] = None):
+        """`origin` là node_id của peer đã gửi khối cho ta (nếu có), để không thông báo ngược lại."""
+        if isinstance(block, Block): payload = block.to_dict()
+        else: payload, block = block, Block.from_dict(block)
+        compact = make_compact_block(block)
+        push = lambda channel, wanted: self._push_block(channel, payload, compact)
+        self._fan_out('blocks', [payload['hash']], f"khối #{payload['index']}", push, origin)
+
+    def broadcast_transaction(self, transaction: Union[TxRecord, Dict], tx_id: Optional[str] = None, origin: Optional[str] = None):
+        """
+        Đưa giao dịch vào lô chờ lan truyền. Lô được gửi khi đủ Config.P2P_TX_BATCH_MAX
+        giao dịch hoặc sau Config.P2P_TX_BATCH_WINDOW_SECONDS kể từ giao dịch đầu tiên.
+        """
+        record = transaction if isinstance(transaction, TxRecord) else TxRecord(transaction, tx_id)
+        self.mark_known(origin, [record.id])
+        with self._tx_batch_lock:
+            self._tx_batch[record.id] = record
+            if len(self._tx_batch) >= Config.P2P_TX_BATCH_MAX: flush_now = True
+            else:
+                flush_now = False
+                if self._tx_batch_timer is None:
+                    self._tx_batch_timer = threading.Timer(Config.P2P_TX_BATCH_WINDOW_SECONDS, self.flush_transactions)
+                    self._tx_batch_timer.daemon = True
+                    self._tx_batch_timer.start()
+        if flush_now: self.flush_transactions()
+
+    def flush_transactions(self):
+        """Lan truyền ngay lô giao dịch đang chờ."""
+        with self._tx_batch_lock:
+            batch, self._tx_batch = self._tx_batch, {}
+            if self._tx_batch_timer is not None: self._tx_batch_timer.cancel()
+            self._tx_batch_timer = None
+        if not batch: return
+        push = lambda channel, wanted: self._push_transactions(channel, [batch[tx_id].data for tx_id in wanted if tx_id in batch])
+        self._fan_out('transactions', list(batch), f"{len(batch)} giao dịch", push)
+
+    @staticmethod
+    def _push_transactions(channel, transactions: List[Dict]) -> int:
+        status, _ = channel.call('transactions', {'transactions': transactions})
+        if status != 404: return status
+        # Peer cũ chưa có endpoint lô: gửi từng giao dịch.
+        for tx in transactions: status, _ = channel.call('transaction', tx)
+        return status
+
+    @staticmethod
+    def _push_block(channel, payload: Dict, compact: Dict) -> int:
+        """Gửi khối gọn, bổ sung giao dịch peer còn thiếu; quay về khối đầy đủ khi cần."""
+        push_full = lambda: channel.call('block', payload)[0]
+        status, result = channel.call('compact_block', compact)
+        if status == 404: return push_full()
+        if status != 200 or not isinstance(result, dict): return status
+        if result.get('status') == 'missing':
+            try: transactions = [payload['transactions'][position] for position in result.get('missing', [])]
+            except (IndexError, TypeError): return push_full()
+            status, result = channel.call('block_fill', {'hash': payload['hash'], 'transactions': transactions})
+            if status != 200 or not isinstance(result, dict): return status
+        if result.get('status') == 'failed': return push_full()
+        return status
+
+    def _fan_out(self, kind: str, item_ids: List[str], label: str, push: Callable[[Any, List[str]], int], origin: Optional[str] = None):
+        """Xếp hàng việc thông báo các mã tới mọi peer (chỉ những mã peer chưa có) rồi trả về ngay."""
+        self.mark_known(origin, item_ids)
+        targets = []
+        for node_id, address in self._peers():
+            known = self._known_by(node_id)
+            unknown = [item_id for item_id in item_ids if known.get(item_id) is None]
+            if unknown: targets.append((node_id, address, unknown))
+        if not targets: return
+        with self._pending_lock:
+            if self._pending + len(targets) > Config.P2P_MAX_PENDING:
+                logging.warning(f"[P2P] Hàng đợi gửi đã đầy ({self._pending} yêu cầu), bỏ qua việc lan truyền {label}.")
+                return
+            self._pending += len(targets)
+        started = time.perf_counter()
+        results: Dict[str, Optional[float]] = {}
+        results_lock = threading.Lock()
+
+        def on_done(address: str, elapsed_ms: Optional[float]):
+            with results_lock:
+                results[address] = elapsed_ms
+                finished = len(results) == len(targets)
+            if finished: self._report(label, results, (time.perf_counter() - started) * 1000)
+
+        for node_id, address, unknown in targets:
+            try: self._executor.submit(self._deliver, node_id, address, kind, unknown, push, on_done)
+            except RuntimeError:
+                # Trình quản lý đã dừng.
+                with self._pending_lock: self._pending -= 1
+
+    def _deliver(self, node_id: str, address: str, kind: str, item_ids: List[str], push, on_done):
+        """Thông báo các mã cho một peer và chỉ gửi dữ liệu của những mã peer xin."""
+        started = time.perf_counter()
+        elapsed_ms: Optional[float] = None
+        wanted: List[str] = []
+        transport = None
+        try:
+            channel = self._channel(node_id, address)
+            transport = "tcp" if isinstance(channel, TransportClient) else "http"
+            status, result = channel.call('announce', {kind: item_ids})
+            if status == 404: wanted = item_ids  # Peer cũ chưa hỗ trợ inventory.
+            elif status == 200 and isinstance(result, dict):
+                requested = set(result.get('want', {}).get(kind, []))
+                wanted = [item_id for item_id in item_ids if item_id in requested]
+            else: raise TransportError(f"Thông báo inventory bị từ chối (mã {status}).")
+            if wanted: status = push(channel, wanted)
+            # 409 nghĩa là peer đã có dữ liệu này: vẫn tính là đã tới nơi.
+            if status < 500:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.mark_known(node_id, item_ids)
+        except TransportTimeout as e:
+            # Chỉ bỏ yêu cầu quá hạn; kết nối vẫn còn nên không đóng kênh (các yêu cầu khác đang dùng chung).
+            logging.debug(f"[P2P] Hết thời gian chờ khi gửi {len(item_ids)} mục tới {address}: {e}")
+        except (TransportError, AttributeError) as e:
+            logging.debug(f"[P2P] Không gửi được {len(item_ids)} mục tới {address}: {e}")
+            self._drop_channel(node_id)
+        finally:
+            with self._pending_lock: self._pending -= 1
+        self._record(address, elapsed_ms, bool(wanted), transport)
+        on_done(address, elapsed_ms)
+
+    def _record(self, address: str, elapsed_ms: Optional[float], pushed: bool, transport: Optional[str] = None):
+        with self._stats_lock:
+            stats = self.peer_stats.setdefault(address, {"sent": 0, "failed": 0, "pushed": 0, "skipped": 0, "last_ms": None, "avg_ms": None, "transport": None})
+            if transport: stats["transport"] = transport
+            if elapsed_ms is None:
+                stats["failed"] += 1
+                return
+            stats["sent"] += 1
+            stats["pushed" if pushed else "skipped"] += 1
+            stats["last_ms"] = round(elapsed_ms, 2)
+            # Trung bình trượt hàm mũ để phản ánh tình trạng gần đây của peer.
+            stats["avg_ms"] = round(elapsed_ms if stats["avg_ms"] is None else 0.8 * stats["avg_ms"] + 0.2 * elapsed_ms, 2)
+
+    def _report(self, label: str, results: Dict[str, Optional[float]], total_ms: float):
+        delivered = {address: round(ms, 2) for address, ms in results.items() if ms is not None}
+        failed = sorted(address for address, ms in results.items() if ms is None)
+        with self._stats_lock:
+            self.last_broadcast = {"label": label, "total_ms": round(total_ms, 2), "peers": delivered, "failed": failed}
+        slowest = max(delivered.items(), key=lambda item: item[1], default=None)
+        logging.info(f"[P2P] Đã lan truyền {label} tới {len(delivered)}/{len(results)} peer trong {total_ms:.1f} ms"
+                     + (f" (chậm nhất: {slowest[0]} {slowest[1]:.1f} ms)." if slowest else "."))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            peers = {address: dict(stats) for address, stats in self.peer_stats.items()}
+            last_broadcast = dict(self.last_broadcast) if self.last_broadcast else None
+        with self._pending_lock: pending = self._pending
+        return {"pending": pending, "transport_port": self.transport_port, "peers": peers, "last_broadcast": last_broadcast}
@@ -0,0 +1,38 @@
+# sok/snapshot.py
+# -*- coding: utf-8 -*-
+
+import json
+import zlib
+from typing import Iterable, List, Tuple
+from .utils import hash_data
+
+# Một ảnh chụp số dư là danh sách [địa chỉ, số dư] đã sắp xếp theo địa chỉ, tại một độ cao khối.
+# Số dư được cộng/trừ bằng số thực nên có thể lệch ở chữ số cuối giữa các node, và khối bị lùi
+# để lại dòng số dư 0: cam kết được tính trên dạng chuẩn (làm tròn, bỏ số dư 0) để mọi node khớp nhau.
+BALANCE_DECIMALS = 8  # Độ chính xác cố định của số dư trong ảnh chụp
+
+def balance_units(balance: float) -> int:
+    return round(balance * 10 ** BALANCE_DECIMALS)
+
+def canonical_balances(balances: Iterable[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    """Sắp theo địa chỉ, làm tròn tới BALANCE_DECIMALS chữ số và bỏ các số dư bằng 0."""
+    result = []
+    for address, balance in sorted(balances):
+        units = balance_units(balance)
+        if units: result.append((address, units / 10 ** BALANCE_DECIMALS))
+    return result
+
+def compute_snapshot_commitment(height: int, block_hash: str, balances: Iterable[Tuple[str, float]]) -> str:
+    """
+    Cam kết băm cho ảnh chụp: SHA256 của JSON chuẩn hóa gồm độ cao, mã băm khối và
+    toàn bộ số dư khác 0 (tính bằng đơn vị nguyên 10^-BALANCE_DECIMALS). Bất kỳ thay đổi
+    nào của số dư hay khối gốc đều làm thay đổi cam kết.
+    """
+    payload = json.dumps({'height': height, 'block_hash': block_hash, 'balances': [[address, balance_units(balance)] for address, balance in canonical_balances(balances)]}, sort_keys=True, separators=(',', ':'))
+    return hash_data(payload)
+
+def encode_snapshot(balances: List[Tuple[str, float]]) -> bytes:
+    return zlib.compress(json.dumps([[address, balance] for address, balance in balances], separators=(',', ':')).encode('utf-8'), 6)
+
+def decode_snapshot(data: bytes) -> List[Tuple[str, float]]:
+    return [(address, balance) for address, balance in json.loads(zlib.decompress(data))]
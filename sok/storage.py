@@ -0,0 +1,76 @@
+# sok/storage.py
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import queue
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+class Storage:
+    """
+    Lớp lưu trữ SQLite an toàn cho đa luồng.
+
+    - Chế độ WAL: người đọc không bị chặn trong khi một khối đang được ghi.
+    - Một kết nối ghi duy nhất, được bảo vệ bởi khóa; mỗi `write()` là một giao dịch
+      được commit khi thoát khối `with` hoặc rollback nếu có ngoại lệ.
+    - Một nhóm kết nối chỉ-đọc; mỗi luồng mượn một kết nối qua `read()` và trả lại
+      khi xong, nên các truy vấn đọc (số dư, thống kê) chạy song song với nhau.
+    Với CSDL ':memory:', mọi thao tác đọc dùng chung kết nối ghi (có khóa).
+    """
+    def __init__(self, db_path: str, read_pool_size: int = 8):
+        self.db_path = db_path
+        self._in_memory = db_path == ':memory:' or db_path.startswith('file::memory:')
+        self._write_lock = threading.RLock()
+        self._writer = sqlite3.connect(db_path, check_same_thread=False)
+        self._writer.row_factory = sqlite3.Row
+        if not self._in_memory:
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._read_uri = None if self._in_memory else Path(db_path).resolve().as_uri() + "?mode=ro"
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(read_pool_size)
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._read_uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Cursor]:
+        """Mở một giao dịch ghi; chỉ một luồng được ghi tại một thời điểm."""
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            try:
+                yield cursor
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Mượn một kết nối chỉ-đọc từ nhóm (tạo mới khi cần, tối đa read_pool_size)."""
+        if self._in_memory:
+            with self._write_lock:
+                yield self._writer
+            return
+        with self._reader_slots:
+            try: conn = self._readers.get_nowait()
+            except queue.Empty: conn = self._connect_reader()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction: conn.rollback()
+                self._readers.put(conn)
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try: self._readers.get_nowait().close()
+            except queue.Empty: break
+        logging.info(f"[Storage] Đã đóng CSDL {self.db_path}.")
@@ -1,8 +1,8 @@
 # sok/transaction.py (Phiên bản cuối cùng v12.6 - Final Fix)
-import json, time, logging, hashlib
+import json, time, logging, hashlib, math
 from typing import Optional, TYPE_CHECKING
 from . import wallet
-from .utils import hash_data
+from .utils import hash_data, Config
 
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
@@ -11,6 +11,56 @@ from cryptography.hazmat.backends import default_backend
 if TYPE_CHECKING:
     from .blockchain import Blockchain 
 
+# Chữ ký giao dịch đã xác thực thành công, khóa theo (mã giao dịch, chữ ký).
+# Mã giao dịch băm dữ liệu được ký nhưng KHÔNG gồm sender_address: một lần trúng đệm chỉ bảo đảm
+# chữ ký đúng, nơi dùng vẫn phải kiểm tra địa chỉ người gửi khớp với khóa công khai.
+VERIFIED_SIGNATURES = wallet.LRUCache(Config.SIGNATURE_CACHE_SIZE)
+
+def verify_transaction_signature(public_key_pem_string: str, data_hash: str, signature_hex: str) -> bool:
+    # Hàm này dùng để xác thực GIAO DỊCH, sử dụng padding PSS
+    try:
+        public_key_loaded = wallet.load_public_key_from_pem(public_key_pem_string)
+        public_key_loaded.verify(
+            bytes.fromhex(signature_hex),
+            bytes.fromhex(data_hash),
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256()
+        )
+        return True
+    except Exception: return False
+
+def forget_verified_signature(tx_id: str, signature: Optional[str]):
+    VERIFIED_SIGNATURES.discard((tx_id, signature))
+
+def canonical_transaction_bytes(tx: dict) -> bytes:
+    """Dạng byte chuẩn hóa của giao dịch (JSON sắp khóa, không gồm chữ ký và địa chỉ người gửi); mã giao dịch là SHA256 của nó."""
+    return json.dumps({k: v for k, v in tx.items() if k not in ('signature', 'sender_address')}, sort_keys=True).encode('utf-8')
+
+class TxRecord:
+    """
+    Bản ghi giao dịch gọn dùng trong mempool, lắp khối và ghi khối.
+    Giữ nguyên dict gốc; dạng byte chuẩn hóa, mã giao dịch và kích thước được tính
+    đúng một lần khi tạo thay vì json.dumps + SHA256 lại ở mỗi bước.
+    """
+    __slots__ = ('data', 'canonical', 'id', 'sender', 'amount', 'size')
+
+    def __init__(self, data: dict, tx_id: Optional[str] = None):
+        self.data = data
+        self.canonical = canonical_transaction_bytes(data)
+        self.id = tx_id or hashlib.sha256(self.canonical).hexdigest()
+        self.sender = data.get('sender_address') or ""
+        try: self.amount: Optional[float] = float(data.get('amount'))
+        except (TypeError, ValueError): self.amount = None
+        self.size = len(self.canonical) + len(str(data.get('signature') or "")) + len(self.sender)
+
+    @property
+    def signature(self) -> Optional[str]:
+        return self.data.get('signature')
+
+    @property
+    def is_system(self) -> bool:
+        return self.data.get('sender_public_key_pem') == "0" or self.sender == "0"
+
 class Transaction:
     def __init__(self, sender_public_key_pem: str, recipient_address: str, amount: float, timestamp: Optional[float] = None, signature: Optional[str] = None, sender_address: Optional[str] = None):
         self.sender_public_key_pem = sender_public_key_pem; self.recipient_address = recipient_address; self.amount = float(amount)
@@ -30,26 +80,23 @@ class Transaction:
     def sign(self, private_key_obj):
         if not self.signature: self.signature = wallet.sign_data(private_key_obj, self.calculate_hash())
         
-    def is_valid(self, blockchain_instance: 'Blockchain') -> tuple[bool, str]:
-        # Hàm này dùng để xác thực GIAO DỊCH, sử dụng padding PSS
-        def verify_transaction_signature(public_key_pem_string: str, data_hash: str, signature_hex: str) -> bool:
-            try:
-                public_key_loaded = wallet.load_public_key_from_pem(public_key_pem_string)
-                public_key_loaded.verify(
-                    bytes.fromhex(signature_hex),
-                    bytes.fromhex(data_hash),
-                    padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
-                    hashes.SHA256()
-                )
-                return True
-            except Exception: return False
+    def has_valid_signature(self, tx_id: Optional[str] = None) -> bool:
+        """Xác thực chữ ký RSA-PSS; nếu có `tx_id`, kết quả thành công được đệm theo (tx_id, chữ ký)."""
+        key = (tx_id, self.signature) if tx_id else None
+        if key and VERIFIED_SIGNATURES.get(key): return True
+        if not verify_transaction_signature(self.sender_public_key_pem, self.calculate_hash(), self.signature): return False
+        if key: VERIFIED_SIGNATURES.put(key, True)
+        return True
 
+    def is_valid(self, blockchain_instance: 'Blockchain', tx_id: Optional[str] = None) -> tuple[bool, str]:
         if self.sender_public_key_pem == "0": return (True, "Giao dịch hệ thống hợp lệ") if self.signature in ["genesis_transaction", "mining_reward"] else (False, "Giao dịch hệ thống không hợp lệ")
         if not all([self.sender_public_key_pem, self.recipient_address, self.signature, self.amount is not None]): return False, "Thiếu trường dữ liệu quan trọng"
         if wallet.get_address_from_public_key_pem(self.sender_public_key_pem) != self.sender_address: return False, "Địa chỉ người gửi không khớp với khóa công khai."
-        if not verify_transaction_signature(self.sender_public_key_pem, self.calculate_hash(), self.signature): return False, f"Chữ ký giao dịch không hợp lệ cho địa chỉ {self.sender_address[:10]}..."
-        if blockchain_instance.get_balance(self.sender_address) < self.amount: return False, f"Số dư không đủ. {self.sender_address[:10]}... chỉ có {blockchain_instance.get_balance(self.sender_address)} SOK."
-        if self.amount <= 0: return False, "Số tiền giao dịch phải lớn hơn 0."
+        if not self.has_valid_signature(tx_id): return False, f"Chữ ký giao dịch không hợp lệ cho địa chỉ {self.sender_address[:10]}..."
+        # NaN không thỏa mọi phép so sánh nên phải loại trước khi so với số dư.
+        if not math.isfinite(self.amount) or not self.amount > 0: return False, "Số tiền giao dịch phải là số hữu hạn lớn hơn 0."
+        spendable = blockchain_instance.get_spendable_balance(self.sender_address)
+        if spendable < self.amount: return False, f"Số dư không đủ. {self.sender_address[:10]}... chỉ có {spendable} SOK khả dụng."
         return True, "Giao dịch hợp lệ"
 
     @staticmethod
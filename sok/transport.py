@@ -0,0 +1,220 @@
+# sok/transport.py
+# -*- coding: utf-8 -*-
+
+import json
+import socket
+import struct
+import logging
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional, Tuple
+from .utils import Config
+
+# Kênh TCP bền vững giữa các node, song song với API HTTP (API HTTP vẫn phục vụ ví).
+#
+# Khung (frame): header 12 byte + thân.
+#   độ dài thân (u32) | mã yêu cầu (u32) | cờ (u8) | phương thức hoặc mã trạng thái (u16) | dự phòng (u8)
+# Cờ: bit 0 = khung trả lời, bit 1 = thân được nén zlib. Thân là JSON gọn (UTF-8).
+# Nhiều yêu cầu dùng chung một kết nối: mỗi yêu cầu có mã riêng và câu trả lời có thể về
+# không theo thứ tự, nên một yêu cầu chậm (ví dụ xác thực khối lớn) không chặn các yêu cầu khác.
+FRAME_HEADER = struct.Struct('>IIBHx')
+FLAG_RESPONSE = 0x01
+FLAG_COMPRESSED = 0x02
+COMPRESS_THRESHOLD = 1024  # Thân lớn hơn bấy nhiêu byte thì được nén
+
+METHODS = ('hello', 'announce', 'compact_block', 'block_fill', 'block', 'transactions', 'transaction', 'peers')
+METHOD_IDS = {name: method_id for method_id, name in enumerate(METHODS)}
+
+class TransportError(Exception):
+    """Lỗi kết nối hoặc hết thời gian chờ trên kênh TCP."""
+
+class TransportTimeout(TransportError):
+    """Hết thời gian chờ câu trả lời; chỉ yêu cầu đó bị bỏ, kết nối vẫn dùng được."""
+
+def encode_frame(request_id: int, flags: int, code: int, body: Any) -> bytes:
+    payload = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    if len(payload) > COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_COMPRESSED
+    return FRAME_HEADER.pack(len(payload), request_id, flags, code) + payload
+
+def _read_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk: raise TransportError("Kết nối đã đóng.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def read_frame(sock: socket.socket) -> Tuple[int, int, int, Any]:
+    """Đọc một khung; trả về (mã yêu cầu, cờ, phương thức/mã trạng thái, thân đã giải mã)."""
+    length, request_id, flags, code = FRAME_HEADER.unpack(_read_exact(sock, FRAME_HEADER.size))
+    if length > Config.P2P_TRANSPORT_MAX_FRAME: raise TransportError(f"Khung quá lớn ({length} byte).")
+    payload = _read_exact(sock, length)
+    try:
+        if flags & FLAG_COMPRESSED:
+            # Giới hạn cả kích thước sau giải nén để một khung nhỏ không thể nở ra vô hạn trong bộ nhớ.
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(payload, Config.P2P_TRANSPORT_MAX_FRAME)
+            if decompressor.unconsumed_tail: raise TransportError(f"Khung giải nén vượt quá {Config.P2P_TRANSPORT_MAX_FRAME} byte.")
+        return request_id, flags, code, json.loads(payload)
+    except (zlib.error, ValueError) as e:
+        raise TransportError(f"Khung bị hỏng: {e}")
+
+class TransportClient:
+    """
+    Một kết nối TCP bền vững tới một peer. call() gửi yêu cầu rồi chờ câu trả lời có cùng mã;
+    một luồng đọc riêng phân phát câu trả lời nên nhiều luồng có thể gọi đồng thời.
+    Kết nối được mở lại khi cần sau khi bị đứt.
+    """
+    def __init__(self, host: str, port: int, node_id: str, timeout: Optional[float] = None):
+        self.host, self.port, self.node_id = host, port, node_id
+        self.timeout = timeout or Config.P2P_TIMEOUT_SECONDS
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Mã yêu cầu -> (kết nối đã gửi yêu cầu, Future chờ câu trả lời).
+        self._pending: Dict[int, Tuple[socket.socket, Future]] = {}
+        self._next_id = 0
+
+    def _register(self, sock: socket.socket) -> Tuple[int, Future]:
+        self._next_id += 1
+        future: Future = Future()
+        self._pending[self._next_id] = (sock, future)
+        return self._next_id, future
+
+    def _ensure_connected(self) -> socket.socket:
+        """Trả về kết nối hiện tại, mở mới nếu cần. Gọi khi đang giữ self._lock."""
+        if self._sock is not None: return self._sock
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Yêu cầu đầu tiên trên mỗi kết nối cho peer biết node_id của ta; không cần chờ trả lời.
+            sock.sendall(encode_frame(self._next_id + 1, 0, METHOD_IDS['hello'], {'node_id': self.node_id}))
+            sock.settimeout(None)
+        except OSError as e:
+            raise TransportError(f"Không kết nối được {self.host}:{self.port}: {e}")
+        self._register(sock)
+        self._sock = sock
+        threading.Thread(target=self._read_loop, args=(sock,), name=f"p2p-tcp-{self.host}:{self.port}", daemon=True).start()
+        return sock
+
+    def _read_loop(self, sock: socket.socket):
+        error = TransportError("Kết nối đã đóng.")
+        try:
+            while True:
+                request_id, flags, status, body = read_frame(sock)
+                if not flags & FLAG_RESPONSE: continue
+                with self._lock: entry = self._pending.pop(request_id, None)
+                if entry is not None: entry[1].set_result((status, body))
+        except (OSError, TransportError) as e:
+            error = e if isinstance(e, TransportError) else TransportError(str(e))
+        with self._lock:
+            if self._sock is sock: self._sock = None
+            broken = [request_id for request_id, (owner, _) in self._pending.items() if owner is sock]
+            futures = [self._pending.pop(request_id)[1] for request_id in broken]
+        for future in futures: future.set_exception(error)
+        try: sock.close()
+        except OSError: pass
+
+    def call(self, method: str, body: Any = None) -> Tuple[int, Any]:
+        """Gửi một yêu cầu và trả về (mã trạng thái, thân trả lời)."""
+        with self._lock:
+            sock = self._ensure_connected()
+            request_id, future = self._register(sock)
+        self._send(sock, request_id, method, body)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            with self._lock: self._pending.pop(request_id, None)
+            raise TransportTimeout(f"Hết thời gian chờ {method} từ {self.host}:{self.port}.")
+
+    def _send(self, sock: socket.socket, request_id: int, method: str, body: Any):
+        frame = encode_frame(request_id, 0, METHOD_IDS[method], body)
+        try:
+            with self._write_lock: sock.sendall(frame)
+        except OSError as e:
+            with self._lock: self._pending.pop(request_id, None)
+            raise TransportError(f"Không gửi được tới {self.host}:{self.port}: {e}")
+
+    def close(self):
+        with self._lock: sock, self._sock = self._sock, None
+        if sock is not None:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+class TransportServer:
+    """
+    Máy chủ TCP nhận yêu cầu từ các peer. Mỗi kết nối có một luồng đọc; yêu cầu được xử lý
+    trên một nhóm luồng chung và câu trả lời được ghi lại ngay khi xong (có thể không theo
+    thứ tự). `dispatch(phương_thức, thân, node_id_peer)` trả về (mã trạng thái, thân).
+    Số kết nối và số yêu cầu đang chờ của mỗi kết nối đều bị giới hạn, nên hàng đợi của
+    nhóm luồng không thể phình ra vô hạn: kết nối gửi quá nhanh chỉ bị ngừng đọc.
+    """
+    def __init__(self, host: str, port: int, dispatch: Callable[[str, Any, Optional[str]], Tuple[int, Any]], workers: Optional[int] = None):
+        self.host, self.port = host, port
+        self._dispatch = dispatch
+        self._executor = ThreadPoolExecutor(max_workers=workers or Config.P2P_MAX_PARALLEL, thread_name_prefix="p2p-tcp-handler")
+        self._listener: Optional[socket.socket] = None
+        self._stop = threading.Event()
+        self._connections = threading.BoundedSemaphore(Config.P2P_TRANSPORT_MAX_CONNECTIONS)
+
+    def start(self):
+        self._listener = socket.create_server((self.host, self.port))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name="p2p-tcp-accept", daemon=True).start()
+        logging.info(f"[P2P] Kênh TCP nhị phân đang lắng nghe tại {self.host}:{self.port}.")
+
+    def stop(self):
+        self._stop.set()
+        if self._listener is not None: self._listener.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try: sock, peer = self._listener.accept()
+            except OSError: break
+            if not self._connections.acquire(blocking=False):
+                logging.warning(f"[P2P] Đã đủ {Config.P2P_TRANSPORT_MAX_CONNECTIONS} kết nối TCP, từ chối {peer[0]}:{peer[1]}.")
+                sock.close()
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve_connection, args=(sock,), name=f"p2p-tcp-conn-{peer[0]}:{peer[1]}", daemon=True).start()
+
+    def _serve_connection(self, sock: socket.socket):
+        state = {'node_id': None}
+        write_lock = threading.Lock()
+        pending = threading.BoundedSemaphore(Config.P2P_TRANSPORT_MAX_PENDING_PER_CONNECTION)
+        try:
+            while not self._stop.is_set():
+                request_id, flags, method_id, body = read_frame(sock)
+                if flags & FLAG_RESPONSE: continue
+                method = METHODS[method_id] if method_id < len(METHODS) else None
+                if method == 'hello' and isinstance(body, dict): state['node_id'] = body.get('node_id')
+                # Đủ số yêu cầu đang chờ thì ngừng đọc cho tới khi có yêu cầu xong (TCP tự chặn bên gửi).
+                while not pending.acquire(timeout=1):
+                    if self._stop.is_set(): return
+                self._executor.submit(self._handle, sock, write_lock, pending, request_id, method, body, state['node_id'])
+        except (OSError, TransportError, RuntimeError):
+            pass
+        finally:
+            self._connections.release()
+            try: sock.close()
+            except OSError: pass
+
+    def _handle(self, sock: socket.socket, write_lock: threading.Lock, pending: threading.BoundedSemaphore, request_id: int, method: Optional[str], body: Any, origin: Optional[str]):
+        try:
+            if method is None: status, result = 404, None
+            else:
+                try: status, result = self._dispatch(method, body, origin)
+                except Exception as e:
+                    logging.error(f"[P2P] Lỗi khi xử lý yêu cầu TCP {method}: {e}")
+                    status, result = 500, None
+            try:
+                with write_lock: sock.sendall(encode_frame(request_id, FLAG_RESPONSE, status, result))
+            except OSError:
+                pass
+        finally:
+            pending.release()
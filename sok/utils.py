@@ -22,16 +22,70 @@ class Config:
     DIFFICULTY = 5
     MINING_REWARD = 0.06
     HALVING_BLOCK_INTERVAL = 210000
+    MINING_WORKERS = 0  # Số tiến trình PoW; 0 = dùng tất cả các lõi CPU
+    VALIDATION_WORKERS = 0  # Số tiến trình xác thực chuỗi; 0 = dùng tất cả các lõi CPU
+    VALIDATION_CHUNK_SIZE = 256
+    VALIDATE_CHAIN_ON_STARTUP = False  # Xác thực toàn bộ chuỗi trên đĩa khi mở một CSDL có sẵn (chậm với chuỗi dài)
+    KEY_CACHE_SIZE = 10000  # Số khóa công khai / địa chỉ người gửi được đệm (LRU)
+    SIGNATURE_CACHE_SIZE = 100000  # Số chữ ký giao dịch đã xác thực được đệm (LRU)
+    SIGNATURE_PARALLEL_THRESHOLD = 64  # Số chữ ký chưa xác thực tối thiểu để dùng nhóm tiến trình
 
     # Các mục tiêu kinh tế vĩ mô cho AI Agent
     TARGET_BLOCK_TIME_SECONDS = 50
     PENDING_TX_THRESHOLD = 100
 
+    # Điều chỉnh độ khó (DIFFICULTY là độ khó của khối đầu tiên)
+    DIFFICULTY_ADJUSTMENT_INTERVAL = 20  # Tính lại độ khó sau mỗi bấy nhiêu khối
+    DIFFICULTY_ADJUSTMENT_FACTOR = 4  # Tăng/giảm một bậc khi thời gian thực tế lệch mục tiêu quá bấy nhiêu lần
+    MIN_DIFFICULTY = 1
+    MAX_DIFFICULTY = 32
+    DIFFICULTY_RETARGET_HEIGHT = 0  # Khối đầu tiên được điều chỉnh độ khó; CSDL chuyển từ lịch sử độ khó cố định tự ghi giá trị này vào chain_meta, chỉ cần đặt cho node mới đồng bộ chuỗi đó
+    HEADER_HASH_ACTIVATION_HEIGHT = 0  # Các khối trước độ cao này là lịch sử JSON cũ (không kiểm tra PoW); CSDL được chuyển đổi tự ghi giá trị này vào chain_meta
+    MEDIAN_TIME_SPAN = 11  # Dấu thời gian khối phải lớn hơn trung vị của bấy nhiêu khối trước
+    MAX_FUTURE_BLOCK_TIME_SECONDS = 2 * 60 * 60  # Dấu thời gian khối không được vượt quá giờ hiện tại bấy nhiêu giây
+
+    # Giới hạn Mempool
+    MEMPOOL_MAX_TRANSACTIONS = 50000
+    MEMPOOL_MAX_BYTES = 64 * 1024 * 1024
+    MEMPOOL_MAX_PER_SENDER = 1000
+    MEMPOOL_PAGE_SIZE = 500
+
     # Cấu hình Khối Genesis
     INITIAL_SUPPLY_TOKENS = 100000000
     FOUNDER_ADDRESS = "SOd94676cb061bd8e52cb4c89f4688d0962064e061c2a7900d53243a738e7959f5K"
     GENESIS_PREVIOUS_HASH = "0" * 64
     GENESIS_NONCE = 0
 
+    # Cấu hình Lưu trữ
+    DB_READ_POOL_SIZE = 8  # Số kết nối SQLite chỉ-đọc tối đa dùng đồng thời
+    HISTORY_PAGE_SIZE = 200  # Số giao dịch tối đa mỗi trang lịch sử địa chỉ
+    CHAIN_STREAM_BATCH_SIZE = 100  # Số khối mỗi trang SQL / mỗi đoạn khi truyền /chain dạng luồng
+    RESPONSE_CACHE_SIZE = 4096  # Số phản hồi (số dư, thống kê) được đệm theo đỉnh chuỗi
+    RESPONSE_CACHE_CHAIN_RANGES = 32  # Số đoạn /chain được đệm theo đỉnh chuỗi
+    RESPONSE_CACHE_MAX_BLOCKS = 500  # Chỉ đệm đoạn /chain có limit không vượt quá bấy nhiêu khối
+    BALANCE_CACHE_SIZE = 100000  # Số địa chỉ có số dư đã xác nhận được đệm trong bộ nhớ
+    SNAPSHOT_INTERVAL = 1000  # Ghi ảnh chụp số dư sau mỗi bấy nhiêu khối (bội số của DIFFICULTY_ADJUSTMENT_INTERVAL)
+    SNAPSHOT_RETAIN = 3  # Số ảnh chụp gần nhất được giữ lại
+    SNAPSHOT_MIN_AGREEING_PEERS = 2  # Số peer phải cùng công bố một cam kết ảnh chụp
+
     # Cấu hình Mạng lưới
     DEFAULT_NODE_PORT = 5000
+    SYNC_BATCH_SIZE = 500       # Số khối mỗi lần tải khi đồng bộ
+    SYNC_MAX_PARALLEL = 8       # Số yêu cầu tải song song tối đa
+    SYNC_TIMEOUT_SECONDS = 5
+    P2P_MAX_PARALLEL = 16       # Số luồng gửi song song khi lan truyền khối/giao dịch
+    P2P_POOL_SIZE = 4           # Số kết nối HTTP giữ lại cho mỗi peer
+    P2P_TIMEOUT_SECONDS = 3     # Thời gian chờ tối đa cho mỗi peer khi lan truyền
+    P2P_MAX_PENDING = 10000     # Số yêu cầu gửi đang chờ tối đa; vượt quá thì bỏ qua lần lan truyền
+    P2P_SYNC_INTERVAL_SECONDS = 30  # Chu kỳ khám phá peer và đồng bộ chuỗi
+    P2P_KNOWN_INVENTORY_SIZE = 50000  # Số mã khối/giao dịch được nhớ cho mỗi peer (peer đã có)
+    P2P_MAX_INVENTORY = 1000    # Số mã tối đa trong một thông báo inventory
+    P2P_REQUEST_TIMEOUT_SECONDS = 10  # Sau thời gian này mới xin lại một mã đã xin mà chưa nhận được
+    P2P_PARTIAL_BLOCKS = 32     # Số khối gọn đang chờ giao dịch còn thiếu được giữ lại
+    P2P_TX_BATCH_WINDOW_SECONDS = 0.2  # Thời gian gom giao dịch trước khi lan truyền thành một lô
+    P2P_TX_BATCH_MAX = 500      # Số giao dịch tối đa mỗi lô; đủ lô thì gửi ngay
+    P2P_TRANSPORT_ENABLED = False  # Bật kênh TCP nhị phân giữa các node (song song với API HTTP)
+    P2P_TRANSPORT_PORT_OFFSET = 1000  # Cổng TCP = cổng HTTP + bấy nhiêu (khi không chỉ định riêng)
+    P2P_TRANSPORT_MAX_FRAME = 64 * 1024 * 1024  # Kích thước thân khung tối đa (byte)
+    P2P_TRANSPORT_MAX_CONNECTIONS = 128  # Số kết nối TCP đến tối đa; kết nối vượt quá bị đóng ngay
+    P2P_TRANSPORT_MAX_PENDING_PER_CONNECTION = 64  # Số yêu cầu đang xử lý tối đa trên một kết nối; vượt quá thì ngừng đọc
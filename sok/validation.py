@@ -0,0 +1,200 @@
+# sok/validation.py
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .block import Block, decode_block_body
+from .transaction import Transaction, TxRecord, VERIFIED_SIGNATURES
+from .wallet import get_address_from_public_key_pem
+from .mining import DifficultySchedule
+from .utils import Config
+
+SYSTEM_SIGNATURES = ("genesis_transaction", "mining_reward")
+
+def _hash_chunk(block_dicts: List[Dict]) -> List[Optional[Tuple[str, bool]]]:
+    """
+    Chạy trong tiến trình con: tính mã băm header (một lần) và kiểm tra gốc Merkle
+    cho từng khối. Trả về (hash, merkle_hợp_lệ), hoặc None nếu khối bị lỗi định dạng.
+    """
+    results = []
+    for block_data in block_dicts:
+        try:
+            if 'body' in block_data: transactions = decode_block_body(block_data['body'])
+            else: transactions = block_data['transactions']
+            if isinstance(transactions, str): transactions = json.loads(transactions)
+            block = Block(block_data['index'], block_data['previous_hash'], block_data['timestamp'], transactions, block_data['nonce'], block_data.get('merkle_root'), block_data['difficulty'])
+            results.append((block.hash, block.has_valid_merkle_root()))
+        except (KeyError, TypeError, ValueError):
+            results.append(None)
+    return results
+
+def _verify_signature_chunk(transactions: List[Dict]) -> List[bool]:
+    """Chạy trong tiến trình con: kiểm tra địa chỉ người gửi và chữ ký RSA-PSS của từng giao dịch."""
+    results = []
+    for tx in transactions:
+        try: transaction = Transaction.from_dict(tx)
+        except (TypeError, ValueError):
+            results.append(False)
+            continue
+        results.append(bool(transaction.signature) and get_address_from_public_key_pem(transaction.sender_public_key_pem) == transaction.sender_address and transaction.has_valid_signature())
+    return results
+
+def is_transaction_list(transactions: Any) -> bool:
+    """Thân khối phải là danh sách các dict; kiểm tra trước khi mọi bước khác gọi tx.get()."""
+    return isinstance(transactions, list) and all(isinstance(tx, dict) for tx in transactions)
+
+def check_system_transactions(transactions: List[Dict], index: int, mining_reward: float) -> bool:
+    """Giao dịch hệ thống: chỉ khối Sáng thế có genesis_transaction; mỗi khối khác tối đa một phần thưởng đào."""
+    rewards = 0
+    for tx in transactions:
+        if tx.get('sender_public_key_pem') != "0" and tx.get('sender_address') != "0": continue
+        if tx.get('sender_public_key_pem') != "0" or tx.get('sender_address') != "0": return False
+        signature = tx.get('signature')
+        if index == 0:
+            if signature != "genesis_transaction": return False
+            continue
+        if signature != "mining_reward": return False
+        rewards += 1
+        try: amount = float(tx.get('amount'))
+        except (TypeError, ValueError): return False
+        if rewards > 1 or not 0 < amount <= mining_reward + 1e-12: return False
+    return True
+
+def apply_balance_overlay(transactions: List[Dict], balances: Dict[str, float]) -> List[bool]:
+    """
+    Áp dụng lần lượt các giao dịch lên bảng số dư trong bộ nhớ (overlay) thay vì
+    truy vấn CSDL cho từng giao dịch. `balances` phải chứa số dư hiện tại của mọi
+    người gửi và bị cập nhật tại chỗ. Trả về cờ hợp lệ của từng giao dịch; giao dịch
+    không hợp lệ (số tiền không hữu hạn, không dương hoặc vượt số dư) không làm thay đổi overlay.
+    """
+    results = []
+    for tx in transactions:
+        sender, recipient = tx.get('sender_address'), tx.get('recipient_address')
+        try: amount = float(tx.get('amount'))
+        except (TypeError, ValueError):
+            results.append(False)
+            continue
+        if not math.isfinite(amount):
+            results.append(False)
+            continue
+        if sender != "0":
+            if not amount > 0 or balances.get(sender, 0.0) < amount:
+                results.append(False)
+                continue
+            balances[sender] -= amount
+        if recipient in balances: balances[recipient] += amount
+        results.append(True)
+    return results
+
+class BlockValidator:
+    """
+    Xác thực chữ ký của toàn bộ giao dịch trong một khối.
+    Địa chỉ người gửi luôn được đối chiếu với khóa công khai; chữ ký đã có trong bộ đệm
+    VERIFIED_SIGNATURES (ví dụ đã kiểm tra khi vào mempool) được bỏ qua; phần còn lại
+    được chia đều cho một nhóm tiến trình khi số lượng đủ lớn
+    (Config.SIGNATURE_PARALLEL_THRESHOLD), nên thời gian chấp nhận một khối lớn giảm
+    theo số lõi CPU.
+    """
+    def __init__(self, workers: Optional[int] = None, parallel_threshold: Optional[int] = None):
+        self.workers: int = max(1, workers or Config.VALIDATION_WORKERS or os.cpu_count() or 1)
+        self.parallel_threshold: int = parallel_threshold or Config.SIGNATURE_PARALLEL_THRESHOLD
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'BlockValidator':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def verify_signatures(self, records: List[TxRecord]) -> bool:
+        # Mã giao dịch không gồm sender_address nên bộ đệm chữ ký không bảo đảm địa chỉ:
+        # luôn kiểm tra địa chỉ khớp khóa công khai (rẻ, có đệm) cho mọi giao dịch.
+        records = [record for record in records if not record.is_system]
+        if not all(get_address_from_public_key_pem(record.data.get('sender_public_key_pem') or "") == record.sender for record in records): return False
+        pending = [record for record in records if not VERIFIED_SIGNATURES.get((record.id, record.signature))]
+        if not pending: return True
+        unverified = [record.data for record in pending]
+        if self.workers == 1 or len(unverified) < self.parallel_threshold:
+            results = _verify_signature_chunk(unverified)
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            size = -(-len(unverified) // self.workers)
+            chunks = [unverified[i:i + size] for i in range(0, len(unverified), size)]
+            results = list(chain.from_iterable(self._pool.map(_verify_signature_chunk, chunks)))
+        if not all(results): return False
+        for record in pending: VERIFIED_SIGNATURES.put((record.id, record.signature), True)
+        return True
+
+class ChainValidator:
+    """
+    Xác thực chuỗi dạng luồng (streaming).
+    Các khối được đọc từ một iterator theo từng đoạn `chunk_size`. Việc băm header và
+    kiểm tra gốc Merkle của từng đoạn được chia cho một nhóm tiến trình, còn tiến trình
+    chính kiểm tra liên kết previous_hash theo đúng thứ tự. Chỉ có tối đa 2 × workers
+    đoạn được giữ trong bộ nhớ cùng lúc nên bộ nhớ không phụ thuộc vào độ dài chuỗi.
+    """
+    def __init__(self, workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.workers: int = max(1, workers or Config.VALIDATION_WORKERS or os.cpu_count() or 1)
+        self.chunk_size: int = chunk_size or Config.VALIDATION_CHUNK_SIZE
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'ChainValidator':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _chunk_results(self, blocks: Iterable[Dict]):
+        """Sinh lần lượt (block_dict, kết quả băm) theo thứ tự của iterator đầu vào."""
+        iterator = iter(blocks)
+        chunks = iter(lambda: list(islice(iterator, self.chunk_size)), [])
+        first, second = next(chunks, []), next(chunks, [])
+        if self.workers == 1 or not second:
+            # Chỉ một tiến trình hoặc chuỗi ngắn: không cần dựng nhóm tiến trình.
+            for chunk in chain((first, second), chunks):
+                yield from zip(chunk, _hash_chunk(chunk))
+            return
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        in_flight = deque((chunk, self._pool.submit(_hash_chunk, chunk)) for chunk in (first, second))
+        while in_flight:
+            for chunk in islice(chunks, 2 * self.workers - len(in_flight)):
+                in_flight.append((chunk, self._pool.submit(_hash_chunk, chunk)))
+            chunk, future = in_flight.popleft()
+            yield from zip(chunk, future.result())
+
+    def validate(self, blocks: Iterable[Dict], start_index: int = 0, previous_hash: str = Config.GENESIS_PREVIOUS_HASH, schedule: Optional[DifficultySchedule] = None) -> bool:
+        """`schedule` chứa sẵn các khối trước start_index (nếu có) để tính độ khó bắt buộc."""
+        schedule = schedule or DifficultySchedule(Config.DIFFICULTY)
+        expected_index = start_index
+        for block_data, result in self._chunk_results(blocks):
+            if result is None: return False
+            block_hash, merkle_ok = result
+            if block_data.get('index') != expected_index or block_data.get('previous_hash') != previous_hash: return False
+            if block_data.get('hash', block_hash) != block_hash or not merkle_ok: return False
+            if not schedule.accepts_timestamp(block_data.get('timestamp')): return False
+            difficulty = schedule.expected(expected_index)
+            if block_data.get('difficulty') != difficulty: return False
+            if schedule.requires_proof_of_work(expected_index) and not block_hash.startswith("0" * difficulty): return False
+            schedule.push(expected_index, block_data['timestamp'], difficulty)
+            expected_index, previous_hash = expected_index + 1, block_hash
+        if expected_index == start_index: return False
+        logging.info(f"[Validation] Đã xác thực {expected_index - start_index} khối.")
+        return True
@@ -5,9 +5,69 @@ from cryptography.hazmat.primitives.asymmetric import rsa, padding, ec
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.exceptions import InvalidSignature
-from typing import Optional, Any
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Dict, Hashable
 import hashlib
-from .utils import hash_data 
+import threading
+from .utils import hash_data, Config
+
+_MISSING = object()
+
+class LRUCache:
+    """Bộ đệm LRU có giới hạn, an toàn đa luồng, kèm bộ đếm trúng (hits) / trượt (misses)."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[Hashable], Any]) -> Any:
+        """Trả về giá trị đã đệm, hoặc tính bằng `compute(key)` rồi lưu lại. Ngoại lệ không được đệm."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute(key)
+            self.put(key, value)
+        return value
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 4) if total else 0.0}
+
+# Các khóa người gửi lặp lại rất nhiều: đệm đối tượng khóa đã phân tích và địa chỉ suy ra từ PEM.
+PUBLIC_KEY_CACHE = LRUCache(Config.KEY_CACHE_SIZE)
+ADDRESS_CACHE = LRUCache(Config.KEY_CACHE_SIZE)
+
+def key_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {'public_keys': PUBLIC_KEY_CACHE.stats(), 'addresses': ADDRESS_CACHE.stats()}
 
 def public_key_to_pem(public_key_obj: Any) -> str:
     return public_key_obj.public_bytes(
@@ -15,12 +75,16 @@ def public_key_to_pem(public_key_obj: Any) -> str:
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     ).decode('utf-8')
 
-def load_public_key_from_pem(pem_string: str):
+def _parse_public_key_pem(pem_string: str):
     return serialization.load_pem_public_key(
         pem_string.encode('utf-8'),
         backend=default_backend()
     )
 
+def load_public_key_from_pem(pem_string: str):
+    """Phân tích khóa công khai PEM (có đệm LRU; PEM lỗi vẫn ném ngoại lệ như cũ)."""
+    return PUBLIC_KEY_CACHE.get_or_compute(pem_string, _parse_public_key_pem)
+
 class Wallet:
     def __init__(self, private_key_pem: Optional[str] = None):
         if private_key_pem:
@@ -96,8 +160,11 @@ def verify_signature(public_key_pem_string: str, signature_hex: str, original_me
     except Exception:
         return False
 
-def get_address_from_public_key_pem(public_key_pem: str) -> str:
-    """Tạo địa chỉ ví từ public key dạng PEM."""
+def _derive_address(public_key_pem: str) -> str:
     public_key_bytes = public_key_pem.encode('utf-8')
     raw_hash = hash_data(public_key_bytes)
     return f"SO{raw_hash}K"
+
+def get_address_from_public_key_pem(public_key_pem: str) -> str:
+    """Tạo địa chỉ ví từ public key dạng PEM (có đệm LRU)."""
+    return ADDRESS_CACHE.get_or_compute(public_key_pem, _derive_address)